@@ -1,50 +1,107 @@
-from flask import Flask, jsonify, redirect ,request ,session, url_for  
+from startup import StartupTimer
+
+startup_timer = StartupTimer()
+
+from dotenv import load_dotenv
+
+# Load environment variables once, before the modules below read their settings at import
+load_dotenv()
+
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, stream_with_context, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from flask_cors import CORS
-from dotenv import load_dotenv
-from urllib.parse import urlencode
-from spotify import spotify  # This imports the blueprint
+from cache import TTLCache
+from session_store import ServerSideSessionInterface, SessionStore
+from json_provider import init_json_provider
+from search_index import SearchIndex
+from recommend import HAS_NUMPY, Recommender
+from db_metrics import init_query_instrumentation, query_stats
+from metrics import init_request_metrics
 import os
 import time
-import requests
+import json
+import base64
+import binascii
+import gzip
+import hashlib
+import itertools
+import threading
+import click
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, snapshots are then only gzip-compressed
+    brotli = None
 
 # You MUST set supports_credentials=True
 # CORS(app, origins=["http://localhost:5173"], supports_credentials=True)
 
 
-# Load environment variables
-load_dotenv()
-
-
-app = Flask(__name__)
-
-# CORRECT ORDER
-CORS(app, origins=["https://music-recommender-app.vercel.app", "http://localhost:5173", "http://192.168.29.8:5173/"], supports_credentials=True)
+# Catalogue routes and CLI commands, registered on the app by create_app()
+catalogue = Blueprint("catalogue", __name__, cli_group=None)
 
-# THEN register blueprints
-app.register_blueprint(spotify)
+# Diagnostics (SQL text, request paths, pool state), only registered with
+# DEBUG_ENDPOINTS=true or in debug mode
+debug = Blueprint("debug", __name__)
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "false").lower() == "true"
 
 
 # Database Configuration
-app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URI")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+def engine_options_from_env(uri):
+    # pre_ping drops connections MySQL closed while idle, recycle keeps them under wait_timeout
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 280)),
+    }
+    # SQLite's default pools do not take sizing options
+    if uri and not uri.startswith("sqlite"):
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        )
+    return options
+
 
 # Soptify Configuration
 # Spotify Token Gen SEC
 CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
-#API KEY
-app.secret_key = os.getenv("FLASK_SECRET_KEY") 
-# Add just below app.secret_key
-app.config.update(
-    SESSION_COOKIE_SAMESITE='None',
-    SESSION_COOKIE_SECURE=True
-)
 
+# Initialize Database, bound to the app in create_app()
+db = SQLAlchemy()
+
+
+def warm_up_db_pool(app, connections=int(os.getenv("DB_POOL_WARMUP", 2))):
+    """Open pool connections up front so the first requests don't pay for the handshakes.
+
+    Called per worker (gunicorn's post_worker_init), never in a --preload master.
+    """
+    if connections <= 0:
+        return
+    try:
+        with app.app_context():
+            opened = [db.engine.connect() for _ in range(connections)]
+            for conn in opened:
+                conn.exec_driver_sql("SELECT 1")
+                conn.close()
+    except Exception as e:
+        print(f"[WARN] Database warm-up failed: {e}")
+
+
+@debug.route("/debug/db", methods=["GET"])
+def get_db_debug():
+    stats = query_stats.snapshot()
+    stats["pool"] = db.engine.pool.status()
+    return jsonify(stats)
 
-# Initialize Database
-db = SQLAlchemy(app)
+
+@debug.route("/debug/startup", methods=["GET"])
+def get_startup_debug():
+    return jsonify(startup_timer.snapshot())
 
 
 # Define Music Table Model
@@ -79,104 +136,569 @@ class Music(db.Model):
     developers_choice_music = db.Column(db.String(100))
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "sad_music": self.sad_music,
-            "romantic_music": self.romantic_music,
-            "party_music": self.party_music,
-            "happy_music": self.happy_music,
-            "melancholy_music": self.melancholy_music,
-            "focus_music": self.focus_music,
-            "instrumental_music": self.instrumental_music,
-            "k_pop_music": self.k_pop_music,
-            "electronic_music": self.electronic_music,
-            "rnb_music": self.rnb_music,
-            "blues_music": self.blues_music,
-            "personal_fav": self.personal_fav,
-            "native_music": self.native_music,
-            "classical_music": self.classical_music,
-            "workout_music": self.workout_music,
-            "rock_music": self.rock_music,
-            "rap_music": self.rap_music,
-            "pop_music": self.pop_music,
-            "jazz_music": self.jazz_music,
-            "motivational_music": self.motivational_music,
-            "trending_music": self.trending_music,
-            "latest_music": self.latest_music,
-            "top_music": self.top_music,
-            "hidden_gems_music": self.hidden_gems_music,
-            "developers_choice_music": self.developers_choice_music,
-        }
+        return {field: getattr(self, field) for field in MUSIC_FIELDS}
+
+
+# Field names come from the table itself, so serialisers and genre lists can't drift from the model
+MUSIC_FIELDS = [column.key for column in Music.__table__.columns]
+
+
+# Normalised genre table, one row per (genre, track) instead of one sparse column per genre.
+# position is the music_table id so ordering and cursors stay the same across both schemas.
+class GenreTrack(db.Model):
+    __tablename__ = "genre_tracks"
+
+    genre = db.Column(db.String(32), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    track = db.Column(db.String(100), nullable=False)
+
+    __table_args__ = (db.Index("ix_genre_tracks_position", "position"),)
+
+
+# Set USE_GENRE_TRACKS=true once `flask backfill-genre-tracks` has been run
+USE_GENRE_TRACKS = os.getenv("USE_GENRE_TRACKS", "false").lower() == "true"
+
+
+def music_row_to_genre_tracks(row):
+    return [
+        {"genre": genre, "position": row.id, "track": getattr(row, genre)}
+        for genre in ALLOWED_GENRES
+        if getattr(row, genre) is not None
+    ]
+
+
+def genre_tracks_to_dict(position, tracks):
+    """Rebuild the Music.to_dict() shape from the (genre, track) pairs of one position."""
+    song = {"id": position}
+    song.update((genre, None) for genre in ALLOWED_GENRES)
+    song.update(tracks)
+    return song
+
+
+def sync_genre_tracks(mapper, connection, target):
+    table = GenreTrack.__table__
+    connection.execute(table.delete().where(table.c.position == target.id))
+    rows = music_row_to_genre_tracks(target)
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def delete_genre_tracks(mapper, connection, target):
+    table = GenreTrack.__table__
+    connection.execute(table.delete().where(table.c.position == target.id))
+
+
+if USE_GENRE_TRACKS:
+    event.listen(Music, "after_insert", sync_genre_tracks)
+    event.listen(Music, "after_update", sync_genre_tracks)
+    event.listen(Music, "after_delete", delete_genre_tracks)
+
+
+@catalogue.cli.command("backfill-genre-tracks")
+@click.option("--batch-size", default=1000, show_default=True)
+def backfill_genre_tracks(batch_size):
+    """Create genre_tracks and fill it from music_table."""
+    GenreTrack.__table__.create(db.engine, checkfirst=True)
+    db.session.execute(GenreTrack.__table__.delete())
+
+    # Keyset batches, each fetched in full: inserting while a server-side (yield_per) cursor
+    # is still open makes PyMySQL drain and drop the rest of that result.
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Music).where(Music.id > last_id).order_by(Music.id).limit(batch_size)
+        ).scalars().all()
+        if not rows:
+            break
+        batch = [track for row in rows for track in music_row_to_genre_tracks(row)]
+        if batch:
+            db.session.execute(GenreTrack.__table__.insert(), batch)
+            total += len(batch)
+        last_id = rows[-1].id
+        db.session.expunge_all()
+
+    expected = sum(
+        db.session.query(getattr(Music, genre)).filter(getattr(Music, genre).isnot(None)).count()
+        for genre in ALLOWED_GENRES
+    )
+    copied = db.session.query(GenreTrack).count()
+    if copied != expected:
+        db.session.rollback()
+        raise click.ClickException(f"genre_tracks has {copied} rows, expected {expected}; nothing was committed")
+
+    db.session.commit()
+    print(f"Backfilled {total} genre tracks")
+
+
+# Server-side sessions, enabled with SERVER_SIDE_SESSIONS=true. The cookie then only holds
+# a session id and Spotify tokens stay in this table.
+class UserSession(db.Model):
+    __tablename__ = "user_sessions"
+
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+
+session_store = SessionStore(db, UserSession)
+
+
+@catalogue.cli.command("purge-sessions")
+def purge_sessions():
+    """Delete expired server-side sessions."""
+    print(f"Purged {session_store.purge_expired()} expired sessions")
+
+
+# Catalogue writes reach the in-process caches and indexes only once they are committed.
+# Mapper events fire at flush time, inside the transaction. Applying them there would let a
+# concurrent reader re-cache the rows being replaced, and a rollback would leave changes
+# behind that never happened, so the flush events only note the rows on the session.
+music_commit_listeners = []  # called with {row id: song dict, or None when deleted}
+
+
+def record_music_write(mapper, connection, target):
+    object_session(target).info.setdefault("music_writes", {})[target.id] = target.to_dict()
+
+
+def record_music_delete(mapper, connection, target):
+    object_session(target).info.setdefault("music_writes", {})[target.id] = None
+
+
+def apply_music_writes(session):
+    writes = session.info.pop("music_writes", None)
+    if not writes:
+        return
+    for listener in music_commit_listeners:
+        try:
+            listener(writes)
+        except Exception as e:
+            print(f"[ERROR] Applying committed catalogue writes failed: {e}")
+
+
+def discard_music_writes(session):
+    session.info.pop("music_writes", None)
+
+
+event.listen(Music, "after_insert", record_music_write)
+event.listen(Music, "after_update", record_music_write)
+event.listen(Music, "after_delete", record_music_delete)
+event.listen(Session, "after_commit", apply_music_writes)
+event.listen(Session, "after_rollback", discard_music_writes)
+
+
+# Song catalogue cache, the music_table rarely changes so reads are served from memory
+song_cache = TTLCache(
+    maxsize=int(os.getenv("SONG_CACHE_SIZE", 512)),
+    ttl=int(os.getenv("SONG_CACHE_TTL", 300)),
+    max_bytes=int(os.getenv("SONG_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    sizeof=lambda snapshot: len(snapshot["raw"]) + len(snapshot["gzip"]) + len(snapshot["br"] or b""),
+)
+# Snapshot keys whose payload alone is bigger than the song_cache budget. Their requests go
+# to a streaming fallback until the TTL passes or the catalogue changes.
+oversized_snapshots = TTLCache(maxsize=64, ttl=int(os.getenv("SONG_CACHE_TTL", 300)))
+
+
+def invalidate_song_cache(*args):
+    song_cache.clear()
+    oversized_snapshots.clear()
+    genre_total_cache.clear()
+
+
+# Any committed write to music_table drops cached pages and totals
+music_commit_listeners.append(invalidate_song_cache)
+
+
+SONG_STREAM_BATCH = int(os.getenv("SONG_STREAM_BATCH", 500))
+
+
+def iter_songs():
+    """Yield songs as dicts, fetching yield_per rows at a time instead of the whole table."""
+    if USE_GENRE_TRACKS:
+        query = (
+            db.select(GenreTrack.position, GenreTrack.genre, GenreTrack.track)
+            .order_by(GenreTrack.position)
+            .execution_options(yield_per=SONG_STREAM_BATCH)
+        )
+        rows = db.session.execute(query)
+        for position, group in itertools.groupby(rows, key=lambda row: row[0]):
+            yield genre_tracks_to_dict(position, ((genre, track) for _, genre, track in group))
+        return
+
+    # Plain column tuples skip ORM instance construction and the per-row to_dict call
+    query = (
+        db.select(*Music.__table__.columns)
+        .order_by(Music.id)
+        .execution_options(yield_per=SONG_STREAM_BATCH)
+    )
+    for row in db.session.execute(query):
+        yield dict(zip(MUSIC_FIELDS, row))
+
+
+def stream_songs_json():
+    yield "["
+    for i, song in enumerate(iter_songs()):
+        yield ("," if i else "") + current_app.json.dumps(song)
+    yield "]"
+
+
+def stream_songs_ndjson():
+    for song in iter_songs():
+        yield current_app.json.dumps(song) + "\n"
+
+
+# Brotli's default quality (11) takes seconds on a large catalogue, most of it for the last
+# few percent of ratio
+SNAPSHOT_BROTLI_QUALITY = int(os.getenv("SNAPSHOT_BROTLI_QUALITY", 5))
+
+
+class SnapshotTooLarge(Exception):
+    """The snapshot would not fit song_cache, which would drop it without a word."""
+
+    def __init__(self, raw):
+        super().__init__(f"Snapshot of a {len(raw)} byte payload exceeds SONG_CACHE_MAX_BYTES")
+        self.raw = raw
+
+
+def build_snapshot(build_payload):
+    """Serialise a payload once, exactly as jsonify would, plus its compressed variants.
+
+    The payload is dropped as soon as it is serialised, so the rows and the bytes are not
+    held together while compressing.
+    """
+    raw = current_app.json.response(build_payload()).get_data()
+    budget = song_cache.max_bytes
+    if budget is not None and len(raw) > budget:
+        raise SnapshotTooLarge(raw)
+    snapshot = {
+        "raw": raw,
+        "gzip": gzip.compress(raw, compresslevel=6),
+        "br": brotli.compress(raw, quality=SNAPSHOT_BROTLI_QUALITY) if brotli else None,
+        "etag": hashlib.sha256(raw).hexdigest(),
+    }
+    if budget is not None and song_cache.sizeof(snapshot) > budget:
+        raise SnapshotTooLarge(raw)
+    return snapshot
+
+
+def snapshot_response(key, build_payload, stream=None):
+    """Serve the snapshot for this URL, building it only on the first request after a change.
+
+    Snapshots live in song_cache, so catalogue writes drop them with everything else.
+    `key` holds only the parsed inputs the payload depends on, never the raw URL, so
+    unknown query parameters cannot fill the cache with copies of the same payload.
+
+    A payload too big for song_cache is sent uncompressed that once, and then, while
+    `stream` is given, later requests get `stream()` instead of rebuilding it every time.
+    """
+    key = ("snapshot",) + key
+    if stream is not None and oversized_snapshots.get(key):
+        return stream()
+    try:
+        snapshot = song_cache.get_or_set(key, lambda: build_snapshot(build_payload))
+    except SnapshotTooLarge as e:
+        print(f"[WARN] {e}, serving {key[1]} uncached")
+        oversized_snapshots.set(key, True)
+        return current_app.response_class(e.raw, mimetype="application/json")
+
+    if snapshot["br"] and request.accept_encodings["br"]:
+        body, encoding = snapshot["br"], "br"
+    elif request.accept_encodings["gzip"]:
+        body, encoding = snapshot["gzip"], "gzip"
+    else:
+        body, encoding = snapshot["raw"], None
+
+    response = current_app.response_class(body, mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    # A strong ETag has to differ per encoding of the same payload
+    response.set_etag(f"{snapshot['etag']}-{encoding}" if encoding else snapshot["etag"])
+    return response.make_conditional(request)
 
 
 # Route to fetch all songs
-@app.route("/songs", methods=["GET"])
+@catalogue.route("/songs", methods=["GET"])
 def get_songs():
-    songs = Music.query.all()
-    return jsonify([song.to_dict() for song in songs])
+    # ?format=ndjson or ?stream=1 send rows as they are read, so memory stays flat
+    if request.args.get("format") == "ndjson":
+        return Response(stream_with_context(stream_songs_ndjson()), mimetype="application/x-ndjson")
+    if request.args.get("stream") in ("1", "true"):
+        return Response(stream_with_context(stream_songs_json()), mimetype="application/json")
+
+    # Past SONG_CACHE_MAX_BYTES the catalogue is streamed like ?stream=1, keeping memory flat
+    return snapshot_response(
+        ("songs",),
+        lambda: list(iter_songs()),
+        lambda: Response(stream_with_context(stream_songs_json()), mimetype="application/json"),
+    )
+
+
+@catalogue.route("/songs/cache/stats", methods=["GET"])
+def get_song_cache_stats():
+    return jsonify(song_cache.stats())
+
+
+class CatalogueModel:
+    """An in-memory structure built from music_table, like the search index.
+
+    Built on first use, or ahead of it by warm_up(), and kept current by this process's
+    committed Music writes. Rows can also be written elsewhere, so once the build is `ttl`
+    seconds old it is brought up to date in the background: by `refresh(current)`, which
+    re-indexes only the rows that changed, or else by a fresh build that is swapped in.
+    Requests keep using the current structure meanwhile.
+    """
+
+    def __init__(self, build, ttl, refresh=None):
+        self.build = build  # called inside an app context, returns the built structure
+        self.refresh = refresh  # called inside an app context, updates the structure in place
+        self.ttl = ttl
+        self.current = None
+        self.built_at = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def get(self):
+        if self.current is None:
+            with self._lock:
+                if self.current is None:
+                    self._swap(self.build())
+        elif time.monotonic() - self.built_at > self.ttl:
+            with self._lock:
+                start = not self._rebuilding
+                self._rebuilding = True
+            if start:
+                app = current_app._get_current_object()
+                threading.Thread(target=self._rebuild, args=(app,), daemon=True).start()
+        return self.current
+
+    def warm_up(self, app):
+        """Build in a background thread, so the first request does not wait for it."""
+        def build():
+            with app.app_context():
+                self.get()
+
+        threading.Thread(target=build, daemon=True).start()
+
+    def _swap(self, built):
+        self.current = built
+        self.built_at = time.monotonic()
+
+    def _rebuild(self, app):
+        try:
+            with app.app_context():
+                if self.refresh is not None:
+                    self.refresh(self.current)
+                    self.built_at = time.monotonic()
+                else:
+                    self._swap(self.build())
+        except Exception as e:
+            print(f"[ERROR] Catalogue model rebuild failed: {e}")
+        finally:
+            self._rebuilding = False
+
+
+SEARCH_INDEX_TTL = int(os.getenv("SEARCH_INDEX_TTL", 300))
+
+
+def build_search_index():
+    index = SearchIndex()
+    index.build(iter_songs())
+    return index
+
+
+def refresh_search_index(index):
+    index.refresh(iter_songs())
+
+
+# In-process search over every genre column, built on the first search (or at worker start,
+# see warm_up_catalogue_models) and then kept up to date as Music writes commit
+search_index = CatalogueModel(build_search_index, SEARCH_INDEX_TTL, refresh_search_index)
+
+
+def get_search_index():
+    return search_index.get()
+
+
+# Build the catalogue models when a worker starts instead of on its first search
+CATALOGUE_WARMUP = os.getenv("CATALOGUE_WARMUP", "true").lower() == "true"
+
+
+def warm_up_catalogue_models(app):
+    """Called per worker (gunicorn's post_worker_init), never in a --preload master."""
+    if CATALOGUE_WARMUP:
+        search_index.warm_up(app)
+        if HAS_NUMPY:
+            recommender.warm_up(app)
+
+
+def update_search_index(writes):
+    index = search_index.current
+    if index is None:
+        return
+    for row_id, song in writes.items():
+        if song is None:
+            index.remove_row(row_id)
+        else:
+            index.update_song(song)
+
+
+music_commit_listeners.append(update_search_index)
+
+
+@catalogue.route("/songs/search", methods=["GET"])
+def search_songs():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Missing search query"}), 400
+
+    genres = [genre for genre in request.args.get("genres", "").split(",") if genre]
+    invalid = [genre for genre in genres if genre not in ALLOWED_GENRES]
+    if invalid:
+        return jsonify({"error": "Invalid genre", "genres": invalid}), 400
+
+    try:
+        limit = int_arg("limit", 20, 1, SONG_PAGE_MAX)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    results = get_search_index().search(query, genres=set(genres), limit=limit)
+    return jsonify({"query": query, "results": results, "length": len(results)})
 
 
 # Route to fetch songs by genre
 from flask import request, url_for
 
-@app.route("/songs/<genre>", methods=["GET"])
-def get_songs_by_genre(genre):
-    allowed_genres = [
-        "sad_music",
-        "romantic_music",
-        "party_music",
-        "happy_music",
-        "melancholy_music",
-        "focus_music",
-        "instrumental_music",
-        "k_pop_music",
-        "electronic_music",
-        "rnb_music",
-        "blues_music",
-        "personal_fav",
-        "native_music",
-        "classical_music",
-        "workout_music",
-        "rock_music",
-        "rap_music",
-        "pop_music",
-        "jazz_music",
-        "motivational_music",
-        "trending_music",
-        "latest_music",
-        "top_music",
-        "hidden_gems_music",
-        "developers_choice_music",
-    ]
+ALLOWED_GENRES = [field for field in MUSIC_FIELDS if field != "id"]
+
+# Total non-null rows per genre, counted once per TTL instead of on every page. Rows can
+# be written outside this process, so totals expire like the cached pages do.
+genre_total_cache = TTLCache(maxsize=len(ALLOWED_GENRES), ttl=int(os.getenv("SONG_CACHE_TTL", 300)))
+
+# Largest page any catalogue route returns
+SONG_PAGE_MAX = int(os.getenv("SONG_PAGE_MAX", 100))
 
-    if genre not in allowed_genres:
-        return jsonify({"error": "Invalid genre"}), 400
 
-    offset = int(request.args.get("offset", 0))
-    limit = int(request.args.get("limit", 10))
+def int_arg(name, default, minimum=None, maximum=None):
+    """Read an integer query parameter, clamped to [minimum, maximum]. Raises ValueError."""
+    try:
+        value = int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}")
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
 
+
+def genre_source(genre):
+    """Return (id column, track column, filter) for a genre in whichever schema is active."""
+    if USE_GENRE_TRACKS:
+        return GenreTrack.position, GenreTrack.track, GenreTrack.genre == genre
     genre_column = getattr(Music, genre)
-    total_items = Music.query.filter(genre_column.isnot(None)).count()
+    return Music.id, genre_column, genre_column.isnot(None)
+
+
+def count_genre(genre):
+    id_column, _, condition = genre_source(genre)
+    return db.session.query(id_column).filter(condition).count()
+
+
+def get_genre_total(genre):
+    return genre_total_cache.get_or_set(genre, lambda: count_genre(genre))
+
+
+# Cursors are opaque to clients: urlsafe base64 of {"after": id} or {"before": id}
+def encode_cursor(direction, row_id):
+    raw = json.dumps({direction: row_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
 
+def decode_cursor(cursor):
+    if not cursor:
+        return "after", 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(data, dict):
+            raise ValueError("Invalid cursor")
+        (direction, row_id), = data.items()
+    except (ValueError, TypeError, AttributeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    # bool is an int subclass, so {"after": true} has to be rejected explicitly
+    if direction not in ("after", "before") or not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise ValueError("Invalid cursor")
+    return direction, row_id
+
+
+def get_genre_page_by_cursor(genre, direction, row_id, limit):
+    """Seek on the row id instead of OFFSET so deep pages cost the same as the first one."""
+    id_column, track_column, condition = genre_source(genre)
+    query = db.session.query(id_column, track_column).filter(condition)
+
+    if direction == "after":
+        query = query.filter(id_column > row_id).order_by(id_column.asc())
+    else:
+        query = query.filter(id_column < row_id).order_by(id_column.desc())
+
+    # One extra row tells us whether there is another page in this direction
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "before":
+        rows.reverse()
+    return rows, has_more
+
+
+def genre_cursor_payload(genre, direction, row_id, limit, base_url):
+    rows, has_more = get_genre_page_by_cursor(genre, direction, row_id, limit)
+    results = [row[1] for row in rows]
+
+    # Moving forward, there is a next page only if we fetched an extra row;
+    # moving backward, we came from the next page so it always exists.
+    has_next = has_more if direction == "after" else bool(rows)
+    has_prev = has_more if direction == "before" else (row_id > 0 and bool(rows))
+
+    next_cursor = encode_cursor("after", rows[-1][0]) if has_next else None
+    prev_cursor = encode_cursor("before", rows[0][0]) if has_prev else None
+
+    return {
+        "results": results,
+        "total_items": get_genre_total(genre),
+        "has_more": has_next,
+        "length": len(results),
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "next": f"{base_url}?cursor={next_cursor}&limit={limit}" if next_cursor else None,
+        "prev": f"{base_url}?cursor={prev_cursor}&limit={limit}" if prev_cursor else None,
+    }
+
+
+def genre_offset_payload(genre, offset, limit, base_url):
+    total_items = get_genre_total(genre)
+
+    id_column, track_column, condition = genre_source(genre)
     songs = (
-        Music.query.with_entities(genre_column)
-        .filter(genre_column.isnot(None))
+        db.session.query(track_column)
+        .filter(condition)
+        .order_by(id_column.asc())
         .offset(offset)
         .limit(limit)
         .all()
     )
-
     results = [song[0] for song in songs]
+    return offset_page_payload(results, offset, limit, total_items, base_url)
+
 
+def offset_page_payload(results, offset, limit, total_items, base_url):
     next_offset = offset + limit
     prev_offset = max(0, offset - limit)
 
     # Create full URLs for next and previous
-    base_url = request.base_url
     next_url = f"{base_url}?offset={next_offset}&limit={limit}" if next_offset < total_items else None
     prev_url = f"{base_url}?offset={prev_offset}&limit={limit}" if offset > 0 else None
 
-    return jsonify({
+    return {
         "results": results,
         "next_offset": next_offset,
         "total_items": total_items,
@@ -184,10 +706,233 @@ def get_songs_by_genre(genre):
         "length": len(results),
         "next": next_url,
         "prev": prev_url
+    }
+
+
+def get_first_pages(genres, limit):
+    """First `limit` tracks and the total of every genre, read in one UNION ALL query.
+
+    COUNT(*) OVER () is evaluated before each branch's LIMIT, so every returned row also
+    carries its genre's total. Genres without tracks return no rows at all.
+    """
+    branches = []
+    for genre in genres:
+        id_column, track_column, condition = genre_source(genre)
+        page = (
+            db.select(
+                db.literal(genre).label("genre"),
+                id_column.label("id"),
+                track_column.label("track"),
+                db.func.count().over().label("total"),
+            )
+            .where(condition)
+            .order_by(id_column.asc())
+            .limit(limit)
+            .subquery()
+        )
+        branches.append(db.select(page))
+
+    pages = {genre: {"results": [], "total_items": 0} for genre in genres}
+    for genre, row_id, track, total in sorted(db.session.execute(db.union_all(*branches)), key=lambda row: row[1]):
+        pages[genre]["results"].append(track)
+        pages[genre]["total_items"] = total
+    return pages
+
+
+def genre_batch_payload(genres, limit):
+    pages = get_first_pages(genres, limit)
+    payload = {}
+    for genre, page in pages.items():
+        genre_total_cache.set(genre, page["total_items"])
+        base_url = url_for("catalogue.get_songs_by_genre", genre=genre, _external=True)
+        payload[genre] = offset_page_payload(page["results"], 0, limit, page["total_items"], base_url)
+    return {"genres": payload, "length": len(payload)}
+
+
+# First page of several genres in one request and one query, for the home page rows
+@catalogue.route("/songs/batch", methods=["GET"])
+def get_songs_batch():
+    genres = list(dict.fromkeys(genre for genre in request.args.get("genres", "").split(",") if genre))
+    if not genres:
+        return jsonify({"error": "Missing genres"}), 400
+    invalid = [genre for genre in genres if genre not in ALLOWED_GENRES]
+    if invalid:
+        return jsonify({"error": "Invalid genre", "genres": invalid}), 400
+
+    try:
+        limit = int_arg("limit", 10, 1, SONG_PAGE_MAX)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Page links are absolute, so the host is part of the key
+    return snapshot_response(
+        ("batch", request.host_url, tuple(genres), limit),
+        lambda: genre_batch_payload(genres, limit),
+    )
+
+
+@catalogue.route("/songs/<genre>", methods=["GET"])
+def get_songs_by_genre(genre):
+    if genre not in ALLOWED_GENRES:
+        return jsonify({"error": "Invalid genre"}), 400
+
+    try:
+        limit = int_arg("limit", 10, 1, SONG_PAGE_MAX)
+        offset = int_arg("offset", 0, 0)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    base_url = request.base_url
+
+    # Cursor mode, used when the client sends ?cursor= (empty for the first page)
+    if "cursor" in request.args:
+        try:
+            direction, row_id = decode_cursor(request.args.get("cursor"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return snapshot_response(
+            ("genre", request.host_url, genre, direction, row_id, limit),
+            lambda: genre_cursor_payload(genre, direction, row_id, limit, base_url)
+        )
+
+    return snapshot_response(
+        ("genre", request.host_url, genre, "offset", offset, limit),
+        lambda: genre_offset_payload(genre, offset, limit, base_url),
+    )
+
+
+RECOMMENDER_TTL = int(os.getenv("RECOMMENDER_TTL", 300))
+
+
+def build_recommender():
+    model = Recommender()
+    model.build(iter_songs(), ALLOWED_GENRES)
+    return model
+
+
+def refresh_recommender(model):
+    model.refresh(iter_songs())
+
+
+# Co-occurrence model behind /recommend. Like the search index it is built at worker start
+# (or on the first request), kept up to date as Music writes commit and refreshed in place
+# every RECOMMENDER_TTL seconds, so queries never hit the DB.
+recommender = CatalogueModel(build_recommender, RECOMMENDER_TTL, refresh_recommender)
+
+
+def get_recommender():
+    return recommender.get()
+
+
+def update_recommender(writes):
+    model = recommender.current
+    if model is None:
+        return
+    for row_id, song in writes.items():
+        if song is None:
+            model.remove_row(row_id)
+        else:
+            model.update_song(song)
+
+
+music_commit_listeners.append(update_recommender)
+
+
+@catalogue.route("/recommend", methods=["GET"])
+def recommend_songs():
+    if not HAS_NUMPY:
+        return jsonify({"error": "Recommendations are unavailable", "details": "numpy is not installed"}), 503
+
+    tracks = [track for track in request.args.getlist("track") if track.strip()]
+    genres = [genre for genre in request.args.get("genres", "").split(",") if genre]
+    invalid = [genre for genre in genres if genre not in ALLOWED_GENRES]
+    if invalid:
+        return jsonify({"error": "Invalid genre", "genres": invalid}), 400
+    if not tracks and not genres:
+        return jsonify({"error": "Missing seeds", "details": "Pass ?track= and/or ?genres="}), 400
+
+    try:
+        limit = int_arg("limit", 20, 1, SONG_PAGE_MAX)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    results, unknown = get_recommender().recommend(tracks, genres, limit)
+    if tracks and len(unknown) == len(tracks) and not genres:
+        return jsonify({"error": "Unknown tracks", "tracks": unknown}), 404
+    return jsonify({
+        "seeds": {"tracks": tracks, "genres": genres},
+        "unknown_tracks": unknown,
+        "results": results,
+        "length": len(results),
     })
 
 
+startup_timer.record("import", startup_timer.started)
+
+
+def create_app():
+    """Build the Flask app. gunicorn loads it with `app:create_app()` (see gunicorn.conf.py).
+
+    The Spotify blueprint and its HTTP client are only imported here. The engine opens
+    no connections until first use, so a --preload master can fork without sharing any.
+    """
+    with startup_timer.phase("config"):
+        app = Flask(__name__)
+
+        app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URI")
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options_from_env(app.config["SQLALCHEMY_DATABASE_URI"])
+
+        #API KEY
+        app.secret_key = os.getenv("FLASK_SECRET_KEY")
+        # Add just below app.secret_key
+        app.config.update(
+            SESSION_COOKIE_SAMESITE='None',
+            SESSION_COOKIE_SECURE=True
+        )
+
+    with startup_timer.phase("extensions"):
+        init_json_provider(app)
+        init_request_metrics(app)
+
+        # CORRECT ORDER
+        CORS(app, origins=["https://music-recommender-app.vercel.app", "http://localhost:5173", "http://192.168.29.8:5173/"], supports_credentials=True)
+
+        db.init_app(app)
+        init_query_instrumentation(app)
+
+        if os.getenv("SERVER_SIDE_SESSIONS", "false").lower() == "true":
+            app.session_interface = ServerSideSessionInterface(session_store)
+
+    # THEN register blueprints
+    with startup_timer.phase("blueprints"):
+        from spotify import spotify
+
+        app.register_blueprint(spotify)
+        app.register_blueprint(catalogue)
+        if DEBUG_ENDPOINTS or app.debug:
+            app.register_blueprint(debug)
+
+    @app.before_request
+    def record_first_request():
+        startup_timer.first_request()
+
+    startup_timer.ready()
+    return app
+
+
+_default_app = None
+
+
+def __getattr__(name):
+    # Deploys that still run `gunicorn app:app` get an app built on first access, so
+    # importing this module (seed scripts, benchmarks, the CLI) does not build one
+    global _default_app
+    if name == "app":
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # Run the Flask app
 if __name__ == "__main__":
     print("Flask app is starting...")
-    app.run(debug=True)  
+    create_app().run(debug=True)  
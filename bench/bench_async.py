@@ -0,0 +1,131 @@
+"""Compare sync and gevent gunicorn workers on a Spotify proxy route.
+
+Starts the mock Spotify server, then for each worker class boots one gunicorn worker
+pointed at the mock and fires concurrent requests at /player/devices.
+
+    python bench/bench_async.py --requests 2000 --concurrency 200 --latency-ms 100
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from mock_spotify import start_mock_spotify
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "bench-secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def session_cookie():
+    """Signed session cookie holding a token that will not need a refresh during the run."""
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    return serializer.dumps({
+        "access_token": "bench-token",
+        "refresh_token": "bench-refresh",
+        "expires_at": time.time() + 3600,
+    })
+
+
+def start_gunicorn(worker_class, threads, mock_port, port):
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS="1",
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        SPOTIFY_ACCOUNTS_URL=f"http://127.0.0.1:{mock_port}",
+        SPOTIFY_API_URL=f"http://127.0.0.1:{mock_port}/v1",
+        SPOTIFY_POOL_SIZE="500",
+        # Measure the serving model, not the outbound rate limiter
+        SPOTIFY_APP_RATE="100000",
+        SPOTIFY_APP_BURST="100000",
+        SPOTIFY_USER_RATE="100000",
+        SPOTIFY_USER_BURST="100000",
+        FLASK_SECRET_KEY=SECRET_KEY,
+        DATABASE_URI=os.getenv("DATABASE_URI", f"sqlite:///{tempfile.gettempdir()}/bench_music.db"),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/songs/cache/stats", timeout=1)
+            return proc
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not start")
+
+
+def run_load(url, cookie, total, concurrency):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    headers = {"Cookie": f"session={cookie}"}
+
+    def one(_):
+        start = time.perf_counter()
+        res = session.get(url, headers=headers, timeout=60)
+        return time.perf_counter() - start, res.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    errors = sum(1 for r in results if r[1] != 200)
+    return {
+        "rps": total / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--sync-threads", type=int, default=4)
+    args = parser.parse_args()
+
+    mock = start_mock_spotify(latency_ms=args.latency_ms)
+    cookie = session_cookie()
+
+    for worker_class, threads in (("sync", args.sync_threads), ("gevent", 1)):
+        port = free_port()
+        proc = start_gunicorn(worker_class, threads, mock.server_port, port)
+        try:
+            url = f"http://127.0.0.1:{port}/player/devices"
+            run_load(url, cookie, min(50, args.requests), args.concurrency)  # warm up
+            result = run_load(url, cookie, args.requests, args.concurrency)
+        finally:
+            proc.terminate()
+            proc.wait()
+        label = f"{worker_class} (threads={threads})"
+        print(f"{label:<22} {result['rps']:8.1f} req/s  p50 {result['p50_ms']:7.1f} ms  "
+              f"p95 {result['p95_ms']:7.1f} ms  errors {result['errors']}")
+
+    mock.shutdown()
+
+
+if __name__ == "__main__":
+    main()
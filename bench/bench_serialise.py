@@ -0,0 +1,61 @@
+"""Rows/sec of the old and new /songs serialisation paths over a SQLite music_table.
+
+    python bench/bench_serialise.py --rows 50000
+
+before: Music.query.all() -> Music.to_dict() per row -> stdlib json (jsonify's encoder)
+after:  Core select of column tuples -> dict(zip(MUSIC_FIELDS, row)) -> app.json provider
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from seed_catalogue import seed_catalogue
+
+
+def time_it(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URI", f"sqlite:///{tempfile.gettempdir()}/bench_serialise.db")
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    import app as app_module
+
+    app, db, Music = app_module.create_app(), app_module.db, app_module.Music
+    stdlib = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+    with app.app_context():
+        seed_catalogue(app_module, args.rows)
+
+        def before():
+            db.session.expunge_all()
+            stdlib.encode([song.to_dict() for song in Music.query.all()])
+
+        def after():
+            db.session.expunge_all()
+            app.json.dumps(list(app_module.iter_songs()))
+
+        for label, fn in (("before", before), ("after", after)):
+            elapsed = time_it(fn, args.repeat)
+            print(f"{label:<7} {args.rows / elapsed:12,.0f} rows/s  ({elapsed * 1000:.1f} ms)  "
+                  f"[{type(app.json).__name__ if label == 'after' else 'stdlib json'}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Local stand-in for accounts.spotify.com and api.spotify.com.
+
+Point the app at it with
+    SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8900 SPOTIFY_API_URL=http://127.0.0.1:8900/v1
+
+Run standalone with `python bench/mock_spotify.py --port 8900 --latency-ms 50`.
+Add `--rate-limit-ratio 0.05 --retry-after 1` to answer a share of API calls with 429.
+Paged endpoints hold `--library-total` items (default 200), so ?all=1 aggregation stops.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.05
+    rate_limit_ratio = 0.0
+    retry_after = 1
+    library_total = 200
+    rng = random.Random(0)
+    stats = {}
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        with self.stats_lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _respond(self, method):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == "/api/token":
+            self._read_body()
+            return self._send(200, {
+                "access_token": f"mock-token-{time.time():.0f}",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "refresh_token": "mock-refresh-token",
+            })
+
+        self._read_body()
+        with self.stats_lock:
+            throttled = self.rng.random() < self.rate_limit_ratio
+        if throttled:
+            return self._send(
+                429,
+                {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                {"Retry-After": str(self.retry_after)},
+            )
+        if method in ("PUT", "POST") and url.path.startswith("/v1/me/player"):
+            return self._send(204)
+        if url.path == "/v1/me":
+            return self._send(200, {"id": "mock-user", "display_name": "Mock User", "images": []})
+
+        limit = int(query.get("limit", ["20"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        return self._send(200, {
+            "href": self.path,
+            "items": [{"id": f"item-{i}"} for i in range(offset, min(offset + limit, self.library_total))],
+            "limit": limit,
+            "offset": offset,
+            "total": self.library_total,
+        })
+
+    def do_GET(self):
+        self._respond("GET")
+
+    def do_POST(self):
+        self._respond("POST")
+
+    def do_PUT(self):
+        self._respond("PUT")
+
+
+def start_mock_spotify(port=0, latency_ms=50, rate_limit_ratio=0.0, retry_after=1, seed=0,
+                       library_total=200):
+    """Start the mock in a background thread and return the server (its port is server_port).
+
+    `rate_limit_ratio` of the API calls (never the token endpoint) get a 429 with
+    Retry-After: `retry_after`. Every paged endpoint reports `library_total` items.
+    server.stats counts the responses sent by status.
+    """
+    handler = type("Handler", (MockSpotifyHandler,), {
+        "latency": latency_ms / 1000,
+        "rate_limit_ratio": rate_limit_ratio,
+        "retry_after": retry_after,
+        "library_total": library_total,
+        "rng": random.Random(seed),
+        "stats": {},
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.stats = handler.stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--library-total", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_mock_spotify(
+        args.port, args.latency_ms, args.rate_limit_ratio, args.retry_after, args.seed, args.library_total,
+    )
+    print(f"Mock Spotify listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
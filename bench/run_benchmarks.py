@@ -0,0 +1,323 @@
+"""Scripted load scenarios against a local gunicorn, a seeded catalogue and the mock Spotify.
+
+    python bench/run_benchmarks.py --rows 100000 --requests 500 --concurrency 32
+    python bench/run_benchmarks.py --rows 100000 --compare bench/results/<earlier run>.json
+
+Each scenario reports throughput, p50/p95/p99 latency, status counts and the peak RSS
+of the gunicorn processes while it ran. Results are written as JSON (under bench/results/
+by default) together with the settings and commit they came from, so two runs can be
+diffed with --compare. Catalogue paths are drawn from a seeded RNG, so the same settings
+replay the same requests.
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_async import SECRET_KEY, free_port, session_cookie
+from mock_spotify import start_mock_spotify
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+SEARCH_TERMS = ("love", "night", "dre", "summer rain", "gold", "mid", "electric dance", "neon")
+
+
+def cursor_after(row_id):
+    # Same encoding as app.encode_cursor
+    raw = json.dumps({"after": row_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def genre_offset_paths(rng, rows, genres, count):
+    return [f"/songs/{rng.choice(genres)}?offset={rng.randrange(0, max(rows // 4, 1))}&limit=20"
+            for _ in range(count)]
+
+
+def genre_cursor_paths(rng, rows, genres, count):
+    return [f"/songs/{rng.choice(genres)}?cursor={cursor_after(rng.randrange(0, rows))}&limit=20"
+            for _ in range(count)]
+
+
+def search_paths(rng, rows, genres, count):
+    return [f"/songs/search?q={rng.choice(SEARCH_TERMS)}&limit=20" for _ in range(count)]
+
+
+# name -> (path generator or fixed path, needs a Spotify session, request cap)
+# The cap keeps whole-catalogue scenarios affordable at 1M rows.
+SCENARIOS = {
+    "songs_snapshot": ("/songs", False, 50),
+    "songs_stream": ("/songs?stream=1", False, 20),
+    "genre_offset": (genre_offset_paths, False, None),
+    "genre_cursor": (genre_cursor_paths, False, None),
+    "genre_batch": ("/songs/batch?genres=trending_music,latest_music,top_music,hidden_gems_music&limit=10",
+                    False, None),
+    "search": (search_paths, False, None),
+    "spotify_me": ("/me", True, None),
+    "spotify_devices": ("/player/devices", True, None),
+    "spotify_albums_all": ("/me/albums?all=1", True, None),
+}
+
+
+def ensure_catalogue(path, rows, seed, reseed):
+    if reseed or not os.path.exists(path) or count_rows(path) != rows:
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, "bench", "seed_catalogue.py"),
+             "--rows", str(rows), "--path", path, "--seed", str(seed)],
+            check=True,
+        )
+    with sqlite3.connect(path) as conn:
+        return [column[1] for column in conn.execute("PRAGMA table_info(music_table)") if column[1] != "id"]
+
+
+def count_rows(path):
+    try:
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM music_table").fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def start_server(args, db_path, mock_port, port):
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=args.worker_class,
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_TIMEOUT="120",
+        DATABASE_URI=f"sqlite:///{db_path}",
+        FLASK_SECRET_KEY=SECRET_KEY,
+        SERVER_SIDE_SESSIONS="false",
+        DEBUG_ENDPOINTS="true",
+        SPOTIFY_ACCOUNTS_URL=f"http://127.0.0.1:{mock_port}",
+        SPOTIFY_API_URL=f"http://127.0.0.1:{mock_port}/v1",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    started = time.perf_counter()
+    for _ in range(300):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/songs/cache/stats", timeout=1)
+            return proc, round((time.perf_counter() - started) * 1000, 1)
+        except requests.exceptions.RequestException:
+            # Refused before the bind, or accepted by the master while workers still boot
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def process_tree_rss(pid):
+    """Resident memory of a process and its children in bytes, or None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+        total = 0
+        for member in [pid] + children:
+            with open(f"/proc/{member}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return total
+    except (OSError, ValueError):
+        return None
+
+
+class RSSSampler:
+    """Samples the server's RSS in the background and keeps the peak."""
+
+    def __init__(self, pid, interval=0.02):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(latencies, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return latencies[max(math.ceil(fraction * len(latencies)) - 1, 0)]
+
+
+def run_load(base_url, paths, headers, concurrency):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def one(path):
+        start = time.perf_counter()
+        try:
+            res = session.get(base_url + path, headers=headers, timeout=120)
+            res.content
+            status = res.status_code
+        except requests.RequestException:
+            status = "error"
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, paths))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "rps": round(len(results) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+    }
+
+
+def run_scenario(name, args, genres, base_url, server_pid, mock, cookie):
+    source, needs_session, cap = SCENARIOS[name]
+    total = min(args.requests, cap) if cap else args.requests
+    warmup = min(args.warmup, total)
+    rng = random.Random(f"{args.seed}:{name}")
+    if callable(source):
+        paths = source(rng, args.rows, genres, warmup + total)
+    else:
+        paths = [source] * (warmup + total)
+    headers = {"Cookie": f"session={cookie}"} if needs_session else {}
+
+    run_load(base_url, paths[:warmup], headers, args.concurrency)
+    mock_before = dict(mock.stats)
+    with RSSSampler(server_pid) as sampler:
+        result = run_load(base_url, paths[warmup:], headers, args.concurrency)
+    result["peak_rss_mb"] = round(sampler.peak / 2**20, 1) if sampler.peak is not None else None
+    if needs_session:
+        result["upstream_statuses"] = {
+            str(status): count - mock_before.get(status, 0)
+            for status, count in mock.stats.items()
+            if count != mock_before.get(status, 0)
+        }
+    return {"scenario": name, "endpoint": paths[0].split("?")[0] if callable(source) else source, **result}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = {r["scenario"]: r for r in (baseline or {}).get("results", [])}
+    print(f"{'scenario':<20} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>8} {'errors':>6}")
+    for r in results:
+        line = (f"{r['scenario']:<20} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                f"{r['p99_ms']:>9.1f} {r['peak_rss_mb'] if r['peak_rss_mb'] is not None else '-':>8} "
+                f"{r['errors']:>6}")
+        before = previous.get(r["scenario"])
+        if before:
+            line += (f"   req/s {(r['rps'] / before['rps'] - 1) * 100:+.1f}%"
+                     f"  p95 {(r['p95_ms'] / before['p95_ms'] - 1) * 100:+.1f}%")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="catalogue size, 10k to 1M")
+    parser.add_argument("--db", help="catalogue path (default: a per-size file in the temp dir)")
+    parser.add_argument("--reseed", action="store_true", help="regenerate the catalogue even if it exists")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="run only these scenarios (repeatable)")
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50, help="mock Spotify latency")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0,
+                        help="share of mock Spotify API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--library-total", type=int, default=200,
+                        help="items in each mock Spotify library, what ?all=1 aggregates")
+    parser.add_argument("--output", help="results file (default: bench/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to print deltas against")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.gettempdir(), f"bench_music_{args.rows}.db"))
+    genres = ensure_catalogue(db_path, args.rows, args.seed, args.reseed)
+
+    mock = start_mock_spotify(
+        latency_ms=args.latency_ms, rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after, seed=args.seed, library_total=args.library_total,
+    )
+    cookie = session_cookie()
+    port = free_port()
+    proc, boot_ms = start_server(args, db_path, mock.server_port, port)
+    # Cold start: spawn to first response as the client sees it, and the app's own phases
+    startup = {"boot_ms": boot_ms, **requests.get(f"http://127.0.0.1:{port}/debug/startup", timeout=5).json()}
+
+    results = []
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            results.append(run_scenario(name, args, genres, f"http://127.0.0.1:{port}", proc.pid, mock, cookie))
+    finally:
+        proc.terminate()
+        proc.wait()
+        mock.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "startup": startup,
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit'] or 'nocommit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(f"boot {startup['boot_ms']:.0f} ms (app ready in {startup['ready_ms']:.0f} ms)\n")
+    print_results(results, baseline)
+    print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Generate a seeded SQLite music_table for benchmarks.
+
+    python bench/seed_catalogue.py --rows 100000 --path /tmp/bench_music.db
+
+The same --rows, --seed and --fill always produce the same catalogue, so results
+from different runs and commits are comparable. Track names are drawn from small
+word lists, which gives /songs/search realistic shared tokens.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "love night heart dream fire summer rain blue gold midnight city road home light "
+    "wild river star dance shadow golden electric young broken forever moon ocean "
+    "sweet lonely neon paradise thunder velvet echo silver storm crystal highway"
+).split()
+
+INSERT_BATCH = 5000
+
+
+def track_name(rng, row_id):
+    words = " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, 3)))
+    return f"{words} {row_id}"
+
+
+def seed_catalogue(app_module, rows, seed=42, fill=0.3, genre_tracks=False):
+    """Recreate music_table with `rows` rows. Call inside an app context.
+
+    Each genre column is filled with probability `fill`. With genre_tracks=True the
+    normalised genre_tracks table is written alongside, as backfill-genre-tracks would.
+    """
+    db, Music, GenreTrack = app_module.db, app_module.Music, app_module.GenreTrack
+    db.drop_all()
+    db.create_all()
+
+    rng = random.Random(seed)
+    music_batch, genre_batch = [], []
+
+    def flush():
+        if music_batch:
+            db.session.execute(Music.__table__.insert(), music_batch)
+            music_batch.clear()
+        if genre_batch:
+            db.session.execute(GenreTrack.__table__.insert(), genre_batch)
+            genre_batch.clear()
+
+    for row_id in range(1, rows + 1):
+        row = {"id": row_id}
+        for genre in app_module.ALLOWED_GENRES:
+            track = track_name(rng, row_id) if rng.random() < fill else None
+            row[genre] = track
+            if genre_tracks and track is not None:
+                genre_batch.append({"genre": genre, "position": row_id, "track": track})
+        music_batch.append(row)
+        if len(music_batch) == INSERT_BATCH:
+            flush()
+    flush()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--path", default="/tmp/bench_music.db")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fill", type=float, default=0.3)
+    parser.add_argument("--genre-tracks", action="store_true", help="also fill genre_tracks")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.abspath(args.path)}"
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    import app as app_module
+
+    start = time.perf_counter()
+    with app_module.create_app().app_context():
+        seed_catalogue(app_module, args.rows, args.seed, args.fill, args.genre_tracks)
+    print(f"Seeded {args.rows:,} rows into {args.path} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+# Per-request DB timing is diagnostics too, so like /debug/db it is off unless asked for
+DB_QUERY_HEADERS = os.getenv("DB_QUERY_HEADERS", os.getenv("DEBUG_ENDPOINTS", "false")).lower() == "true"
+
+
+class QueryStats:
+    """Process-wide query totals and the most recent slow queries, for /debug/db."""
+
+    def __init__(self):
+        self.queries = 0
+        self.total_ms = 0.0
+        self.slow_queries = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def record(self, statement, elapsed_ms):
+        with self._lock:
+            self.queries += 1
+            self.total_ms += elapsed_ms
+            if elapsed_ms >= DB_SLOW_QUERY_MS:
+                self.slow_queries.append({
+                    "statement": statement[:500],
+                    "ms": round(elapsed_ms, 2),
+                    "path": request.path if has_request_context() else None,
+                    "at": time.time(),
+                })
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "total_ms": round(self.total_ms, 2),
+                "slow_query_ms": DB_SLOW_QUERY_MS,
+                "slow_queries": list(self.slow_queries),
+            }
+
+
+query_stats = QueryStats()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+    query_stats.record(statement, elapsed_ms)
+    if elapsed_ms >= DB_SLOW_QUERY_MS:
+        print(f"[SLOW QUERY] {elapsed_ms:.1f} ms: {statement[:200]}")
+    if has_request_context():
+        g.db_queries = g.get("db_queries", 0) + 1
+        g.db_time_ms = g.get("db_time_ms", 0.0) + elapsed_ms
+
+
+def handle_error(context):
+    # after_cursor_execute never runs for a statement that raised, so drop its start time here
+    if context.connection is not None and context.execution_context is not None:
+        started = context.connection.info.get("query_start")
+        if started:
+            started.pop()
+
+
+def init_query_instrumentation(app):
+    """Count queries and DB time per request, and expose them in X-DB-* response headers."""
+    # The listeners are global, so a second app from the factory must not add them again
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
+
+    if DB_QUERY_HEADERS:
+        @app.after_request
+        def add_query_headers(response):
+            response.headers["X-DB-Queries"] = str(g.get("db_queries", 0))
+            response.headers["X-DB-Time-Ms"] = f"{g.get('db_time_ms', 0.0):.2f}"
+            return response
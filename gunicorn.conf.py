@@ -0,0 +1,52 @@
+import gc
+import os
+
+# GUNICORN_WORKER_CLASS=gevent serves the spotify blueprint cooperatively: the handlers stay
+# as they are, but every blocking Spotify call yields, so one worker keeps hundreds of
+# upstream requests in flight instead of one per thread.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+# Left unset without GUNICORN_BIND, so gunicorn keeps its own default of 0.0.0.0:$PORT
+# (or 127.0.0.1:8000) that PaaS hosts rely on
+if os.getenv("GUNICORN_BIND"):
+    bind = os.getenv("GUNICORN_BIND")
+# `gunicorn -c gunicorn.conf.py` serves the app factory without naming it on the command line
+wsgi_app = "app:create_app()"
+# GUNICORN_PRELOAD=true imports the app once in the master and forks workers from it,
+# so they boot faster and share the imported code and catalogue modules copy-on-write
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+if worker_class == "gevent":
+    # Patch before the app is imported (including under --preload), so that the locks,
+    # thread pools and sockets created at import time are cooperative too
+    from gevent import monkey
+
+    monkey.patch_all()
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything the preloaded app allocated out of the collector's reach. Otherwise
+        # the first collection in each worker writes to those objects and un-shares their pages.
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # With --preload the app, and its engine, were created in the master.
+    # Connections must not be shared across processes, so each worker starts a fresh pool.
+    app = getattr(server.app, "callable", None)
+    if app is not None:
+        from app import db
+
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    from app import warm_up_catalogue_models, warm_up_db_pool
+
+    warm_up_db_pool(worker.wsgi)
+    warm_up_catalogue_models(worker.wsgi)
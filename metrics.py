@@ -0,0 +1,129 @@
+import bisect
+import threading
+import time
+
+from flask import g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    """Counters and latency histograms rendered in the Prometheus text format.
+
+    Each OS thread writes to its own shard, so recording takes no lock. Greenlets
+    share their thread's shard, which is safe because they only switch on I/O.
+    /metrics merges the shards when it is scraped.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._shards = {}
+        self._lock = threading.Lock()
+        self._help = {}
+
+    def _shard(self):
+        thread_id = threading.get_native_id()
+        shard = self._shards.get(thread_id)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(thread_id, ({}, {}))
+        return shard
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, labels, value=1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # one slot per bucket plus +Inf, then the sum
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def _merged(self):
+        counters, histograms = {}, {}
+        for shard_counters, shard_histograms in list(self._shards.values()):
+            for key, value in list(shard_counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, values in list(shard_histograms.items()):
+                merged = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    merged[i] += value
+        return counters, histograms
+
+    def render(self):
+        counters, histograms = self._merged()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                help_kind, help_text = self._help.get(name, (kind, ""))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {help_kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for (name, labels), values in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
+metrics.describe("http_requests_total", "counter", "Requests handled, by route, method and status.")
+metrics.describe("http_request_duration_seconds", "histogram", "Time to produce a response, by route.")
+metrics.describe("spotify_upstream_requests_total", "counter", "Calls made to Spotify, by calling route.")
+metrics.describe("spotify_upstream_duration_seconds", "histogram", "Spotify call latency, by calling route.")
+metrics.describe("spotify_token_refresh_seconds", "histogram", "Spotify token refresh latency, by kind.")
+
+
+def current_route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def init_request_metrics(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get("request_started")
+        if started is not None:
+            labels = (("route", current_route()), ("method", request.method))
+            metrics.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            metrics.inc("http_requests_total", labels + (("status", str(response.status_code)),))
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
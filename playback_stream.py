@@ -0,0 +1,144 @@
+import json
+import os
+import queue
+import threading
+
+STREAM_MIN_INTERVAL = float(os.getenv("PLAYER_STREAM_MIN_INTERVAL", 1))
+STREAM_MAX_INTERVAL = float(os.getenv("PLAYER_STREAM_MAX_INTERVAL", 10))
+STREAM_HEARTBEAT = float(os.getenv("PLAYER_STREAM_HEARTBEAT", 15))
+# Serve streams without gevent anyway, e.g. under the threaded dev server
+STREAM_ALLOW_BLOCKING = os.getenv("PLAYER_STREAM_ALLOW_BLOCKING", "false").lower() == "true"
+
+
+def streaming_supported():
+    """True when an open stream only costs a greenlet rather than a whole worker.
+
+    Under gunicorn's sync workers every stream pins a worker until the timeout kills it,
+    together with whatever else that worker was serving.
+    """
+    if STREAM_ALLOW_BLOCKING:
+        return True
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def diff_state(old, new):
+    """Top-level keys of `new` that differ from `old`, with removed keys set to None."""
+    old = old or {}
+    new = new or {}
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+    changed.update((key, None) for key in old if key not in new)
+    return changed
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class UserChannel:
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.subscribers = set()
+        self.state = None
+        self.has_state = False
+
+
+class PlaybackBroadcaster:
+    """One poller per user, fanning playback diffs out to every open stream of that user.
+
+    `fetch_state(credentials)` returns the current playback dict (or None when nothing
+    is playing) and may update `credentials` in place when it refreshes the token.
+    Pollers are plain threads, so under the gevent worker they are greenlets and idle
+    streams cost no OS thread.
+    """
+
+    def __init__(self, fetch_state):
+        self.fetch_state = fetch_state
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_key, credentials):
+        subscriber = queue.Queue(maxsize=100)
+        with self._lock:
+            channel = self._channels.get(user_key)
+            start_poller = channel is None
+            if start_poller:
+                channel = self._channels[user_key] = UserChannel(credentials)
+            channel.subscribers.add(subscriber)
+            if channel.has_state:
+                subscriber.put(("snapshot", channel.state))
+
+        if start_poller:
+            threading.Thread(target=self._poll, args=(user_key, channel), daemon=True).start()
+        return subscriber
+
+    def unsubscribe(self, user_key, subscriber):
+        with self._lock:
+            channel = self._channels.get(user_key)
+            if channel:
+                channel.subscribers.discard(subscriber)
+
+    def _publish(self, channel, event, data):
+        with self._lock:
+            subscribers = list(channel.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # A stalled client gets a fresh snapshot instead of a backlog of diffs
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(("snapshot", channel.state))
+
+    def _poll(self, user_key, channel):
+        interval = STREAM_MIN_INTERVAL
+        stop = threading.Event()
+        while True:
+            with self._lock:
+                if not channel.subscribers:
+                    del self._channels[user_key]
+                    return
+
+            try:
+                state = self.fetch_state(channel.credentials)
+            except Exception as e:
+                print(f"[ERROR] Playback poll failed: {e}")
+                self._publish(channel, "error", {"error": str(e)})
+                interval = min(interval * 2, STREAM_MAX_INTERVAL)
+                stop.wait(interval)
+                continue
+
+            changes = None
+            if not channel.has_state:
+                channel.state, channel.has_state = state, True
+                self._publish(channel, "snapshot", state)
+            else:
+                changes = diff_state(channel.state, state)
+                channel.state = state
+                if changes:
+                    self._publish(channel, "diff", changes)
+
+            # Poll fast while music plays or something just changed, back off otherwise
+            if changes or (state and state.get("is_playing")):
+                interval = STREAM_MIN_INTERVAL
+            else:
+                interval = min(interval * 2, STREAM_MAX_INTERVAL)
+            stop.wait(interval)
+
+    def stream(self, user_key, credentials):
+        """Generator of SSE text for one connection, ending the subscription on disconnect."""
+        subscriber = self.subscribe(user_key, credentials)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=STREAM_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_event(event, data)
+        finally:
+            self.unsubscribe(user_key, subscriber)
@@ -0,0 +1,267 @@
+import importlib.util
+import threading
+
+# numpy is optional, /recommend answers 503 without it. It is imported on the first
+# build rather than at startup, since it is the heaviest import in the app.
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+np = None
+
+# How much a seed genre also pulls in genres that share tracks with it
+RELATED_GENRE_WEIGHT = 0.5
+
+
+def _kth_best(scores, k):
+    return np.partition(scores, len(scores) - k)[len(scores) - k]
+
+
+class Recommender:
+    """Track recommendations from a track x genre co-occurrence matrix.
+
+    Tracks are keyed by their lower-cased name. Row i of the matrix counts how often
+    track i appears in each genre column of music_table. Seeds (tracks and/or genres)
+    become one genre profile, which is widened to related genres through the genre x genre
+    co-occurrence matrix and then scored against tracks by cosine similarity. Ties go to
+    tracks found in more rows, then to catalogue order. Music writes update the affected
+    rows in place instead of rebuilding.
+
+    Only tracks in the query's strongest genres are scored. Genres are added in order of
+    query weight until no track outside them could beat the current top `limit`, so a
+    query costs about the size of its seed genres rather than the whole catalogue.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def _reset(self, genres, capacity=1024):
+        global np
+        import numpy as np
+
+        self.genres = list(genres)
+        self._genre_index = {genre: i for i, genre in enumerate(self.genres)}
+        self._slots = {}   # track key -> matrix row
+        self._names = []   # matrix row -> track name as first seen
+        self._free = []    # matrix rows released by deleted tracks
+        self._rows = {}    # music_table id -> [(matrix row, genre index)]
+        self._counts = np.zeros((capacity, len(self.genres)), dtype=np.float32)
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        self._totals = np.zeros(capacity, dtype=np.float32)
+        self._cooccurrence = np.zeros((len(self.genres), len(self.genres)), dtype=np.float32)
+        # Matrix rows per genre: an array from the build plus rows added since. Rows that
+        # have left a genre may linger, which only costs scoring them.
+        self._genre_rows = [np.zeros(0, dtype=np.int64) for _ in self.genres]
+        self._genre_added = [[] for _ in self.genres]
+        # Largest sum / norm of any track's counts, so a track whose genres all have query
+        # weight at most w scores at most w * _spread (never shrinks, so always an upper bound)
+        self._spread = 1.0
+
+    def _slot(self, track):
+        key = track.strip().lower()
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+            self._names[slot] = track
+        else:
+            slot = len(self._names)
+            self._names.append(track)
+            if slot == len(self._counts):
+                self._grow()
+        self._slots[key] = slot
+        return slot
+
+    def _grow(self):
+        self._counts = np.concatenate([self._counts, np.zeros_like(self._counts)])
+        self._norms = np.concatenate([self._norms, np.zeros_like(self._norms)])
+        self._totals = np.concatenate([self._totals, np.zeros_like(self._totals)])
+
+    def _row_entries(self, song):
+        return [
+            (self._slot(track), self._genre_index[genre])
+            for genre, track in song.items()
+            if genre in self._genre_index and track
+        ]
+
+    def build(self, songs, genres):
+        """Index an iterable of song dicts shaped like Music.to_dict()."""
+        with self._lock:
+            self._reset(genres)
+            for song in songs:
+                entries = self._row_entries(song)
+                self._rows[song["id"]] = entries
+                for slot, genre in entries:
+                    self._counts[slot, genre] += 1
+            size = len(self._names)
+            counts = self._counts[:size]
+            self._norms[:size] = np.linalg.norm(counts, axis=1)
+            self._totals[:size] = counts.sum(axis=1)
+            self._cooccurrence = counts.T @ counts
+            self._genre_rows = [np.flatnonzero(counts[:, genre]) for genre in range(len(self.genres))]
+            self._widen_spread(np.arange(size))
+            self.ready = True
+
+    def refresh(self, songs):
+        """Bring the matrix in line with a full read of the catalogue, one row at a time.
+
+        Rows whose tracks are unchanged are skipped, changed ones are replaced in place and
+        rows that are gone are removed. The lock is taken per row, so queries keep running.
+        """
+        seen = set()
+        for song in songs:
+            seen.add(song["id"])
+            wanted = sorted(
+                (track.strip().lower(), self._genre_index[genre])
+                for genre, track in song.items()
+                if genre in self._genre_index and track
+            )
+            with self._lock:
+                indexed = sorted(
+                    (self._names[slot].strip().lower(), genre) for slot, genre in self._rows.get(song["id"], [])
+                )
+                if indexed != wanted:
+                    self._replace_row(song["id"], song)
+        with self._lock:
+            for row_id in [row_id for row_id in self._rows if row_id not in seen]:
+                self._replace_row(row_id, None)
+
+    def _widen_spread(self, slots):
+        norms = self._norms[slots]
+        if norms.any():
+            ratios = np.divide(self._totals[slots], norms, out=np.zeros_like(norms), where=norms > 0)
+            self._spread = max(self._spread, float(ratios.max()))
+
+    def _genre_members(self, genre):
+        added = self._genre_added[genre]
+        if added:
+            self._genre_rows[genre] = np.unique(np.concatenate([self._genre_rows[genre], added]))
+            added.clear()
+        return self._genre_rows[genre]
+
+    def update_song(self, song):
+        with self._lock:
+            self._replace_row(song["id"], song)
+
+    def remove_row(self, row_id):
+        with self._lock:
+            self._replace_row(row_id, None)
+
+    def _replace_row(self, row_id, song):
+        old_entries = self._rows.pop(row_id, [])
+        new_entries = self._row_entries(song) if song is not None else []
+        touched = sorted({slot for slot, _ in old_entries + new_entries})
+        if not touched:
+            return
+
+        before = self._counts[touched].copy()
+        for slot, genre in old_entries:
+            self._counts[slot, genre] -= 1
+        for slot, genre in new_entries:
+            self._counts[slot, genre] += 1
+        if new_entries:
+            self._rows[row_id] = new_entries
+        for slot, genre in new_entries:
+            self._genre_added[genre].append(slot)
+
+        after = self._counts[touched]
+        self._cooccurrence += after.T @ after - before.T @ before
+        self._norms[touched] = np.linalg.norm(after, axis=1)
+        self._totals[touched] = after.sum(axis=1)
+        self._widen_spread(touched)
+
+        for slot in touched:
+            if self._totals[slot] == 0:
+                del self._slots[self._names[slot].strip().lower()]
+                self._names[slot] = None
+                self._free.append(slot)
+
+    def _related_genres(self):
+        diagonal = np.sqrt(np.diag(self._cooccurrence))
+        scale = np.outer(diagonal, diagonal)
+        return np.divide(self._cooccurrence, scale, out=np.zeros_like(scale), where=scale > 0)
+
+    def recommend(self, tracks=(), genres=(), limit=20):
+        """Return (results, unknown seed tracks). Seed tracks are never recommended back."""
+        with self._lock:
+            seeds, unknown = [], []
+            for track in tracks:
+                slot = self._slots.get(track.strip().lower())
+                if slot is None:
+                    unknown.append(track)
+                else:
+                    seeds.append(slot)
+
+            profile = np.zeros(len(self.genres), dtype=np.float32)
+            for slot in seeds:
+                profile += self._counts[slot] / self._norms[slot]
+            for genre in genres:
+                profile[self._genre_index[genre]] += 1
+            if not profile.any():
+                return [], unknown
+
+            query = profile + RELATED_GENRE_WEIGHT * (self._related_genres() @ profile)
+            query /= np.linalg.norm(query)
+
+            slots, scores = self._score_candidates(query, set(seeds), limit)
+            limit = min(limit, len(scores))
+            if limit <= 0:
+                return [], unknown
+            # Everything scoring at least the limit-th best, so ties are broken the same way
+            # no matter where the partition cuts them
+            threshold = _kth_best(scores, limit)
+            keep = np.flatnonzero(scores >= threshold)
+            slots, scores = slots[keep], scores[keep]
+            order = np.lexsort((slots, -self._totals[slots], -scores))[:limit]
+            top = slots[order]
+            scores = dict(zip(top.tolist(), scores[order].tolist()))
+
+            return [
+                {
+                    "track": self._names[slot],
+                    "genres": [self.genres[genre] for genre in np.flatnonzero(self._counts[slot])],
+                    "score": round(scores[slot], 4),
+                }
+                for slot in top.tolist()
+            ], unknown
+
+    def _score_candidates(self, query, seeds, limit):
+        """Slots and scores of every track that could make the top `limit` for `query`.
+
+        Genres are taken in order of query weight. After each one, any track not yet scored
+        only appears in lighter genres, so it scores at most the next weight * _spread. Once
+        the limit-th best score so far is above that, no other track can get in.
+        """
+        size = len(self._names)
+        scored = np.zeros(size, dtype=bool)
+        slot_parts, score_parts = [], []
+        total = 0
+        genres = np.argsort(-query)
+        for i, genre in enumerate(genres):
+            if query[genre] <= 0:
+                break
+            members = self._genre_members(genre)
+            members = members[members < size]
+            new = members[~scored[members]]
+            scored[new] = True
+            norms = self._norms.take(new)
+            live = norms > 0
+            if seeds:
+                live &= ~np.isin(new, list(seeds))
+            new, norms = new[live], norms[live]
+            if len(new):
+                slot_parts.append(new)
+                # take() copies whole rows much faster than fancy indexing does
+                score_parts.append((self._counts.take(new, axis=0) @ query) / norms)
+                total += len(new)
+
+            rest = query[genres[i + 1]] * self._spread if i + 1 < len(genres) else 0
+            if rest <= 0:
+                break
+            if total >= limit:
+                scores = np.concatenate(score_parts)
+                if _kth_best(scores, limit) > rest:
+                    break
+
+        if not slot_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(slot_parts), np.concatenate(score_parts)
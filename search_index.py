@@ -0,0 +1,268 @@
+import bisect
+import heapq
+import itertools
+import os
+import re
+import threading
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Rank keys pack (title length, row id, genre) into one int that sorts the same way, so
+# postings are plain int lists: cheap to hash, intersect and keep in memory
+ROW_SHIFT = 8
+LENGTH_SHIFT = 48
+ROW_MASK = (1 << (LENGTH_SHIFT - ROW_SHIFT)) - 1
+GENRE_MASK = (1 << ROW_SHIFT) - 1
+
+# Query terms shorter than this are not expanded as prefixes on their own. They still
+# narrow the matches of a longer term ("love night 5"), but a query made only of short
+# terms has to match whole tokens, so "l" does not walk every token starting with l.
+SEARCH_MIN_PREFIX = int(os.getenv("SEARCH_MIN_PREFIX", 2))
+# Postings of the most selective query term are read this many at a time
+SEARCH_WINDOW = int(os.getenv("SEARCH_WINDOW", 2000))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def _contains(keys, key, start, end):
+    i = bisect.bisect_left(keys, key, start, end)
+    return i < end and keys[i] == key
+
+
+class SearchIndex:
+    """Inverted index over catalogue tracks with ranked prefix matching.
+
+    Documents are (row id, genre) pairs. Every query token has to match the start of
+    some token in the track, so "beat it" and "bea" both find "Beat It". Whole-token
+    matches rank above prefix matches, then shorter titles, then catalogue order.
+
+    Postings are kept sorted in that tie-break order (title length, row id, then genre
+    column), so a query walks its candidates from the front and stops as soon as `limit`
+    results with the best possible score are found, instead of scoring every match and
+    sorting them.
+    """
+
+    def __init__(self):
+        self._tracks = {}    # (row_id, genre) -> track
+        self._postings = {}  # token -> sorted rank keys, see _key()
+        self._tokens = []    # sorted keys of _postings, for prefix ranges
+        self._rows = {}      # row_id -> genres indexed for that row
+        self._genres = []    # genre number in rank keys -> genre
+        self._genre_ids = {}
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def _key(self, doc, track):
+        genre_id = self._genre_ids.get(doc[1])
+        if genre_id is None:
+            genre_id = self._genre_ids[doc[1]] = len(self._genres)
+            self._genres.append(doc[1])
+        return (len(track) << LENGTH_SHIFT) | (doc[0] << ROW_SHIFT) | genre_id
+
+    def _doc(self, key):
+        return (key >> ROW_SHIFT) & ROW_MASK, self._genres[key & GENRE_MASK]
+
+    def _add(self, doc, track):
+        self._tracks[doc] = track
+        self._rows.setdefault(doc[0], set()).add(doc[1])
+        key = self._key(doc, track)
+        for token in set(tokenize(track)):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = []
+                bisect.insort(self._tokens, token)
+            bisect.insort(postings, key)
+
+    def _remove(self, doc):
+        track = self._tracks.pop(doc, None)
+        if track is None:
+            return
+        genres = self._rows[doc[0]]
+        genres.discard(doc[1])
+        if not genres:
+            del self._rows[doc[0]]
+        key = self._key(doc, track)
+        for token in set(tokenize(track)):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            i = bisect.bisect_left(postings, key)
+            if i < len(postings) and postings[i] == key:
+                del postings[i]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def build(self, songs):
+        """Index an iterable of song dicts shaped like Music.to_dict()."""
+        with self._lock:
+            self._tracks, self._postings, self._rows = {}, {}, {}
+            for song in songs:
+                row_id = song["id"]
+                for genre, track in song.items():
+                    if genre == "id" or not track:
+                        continue
+                    doc = (row_id, genre)
+                    self._tracks[doc] = track
+                    self._rows.setdefault(row_id, set()).add(genre)
+                    key = self._key(doc, track)
+                    for token in set(tokenize(track)):
+                        self._postings.setdefault(token, []).append(key)
+            # Sorting once at the end is much cheaper than keeping every list sorted on insert
+            for keys in self._postings.values():
+                keys.sort()
+            self._tokens = sorted(self._postings)
+            self.ready = True
+
+    def _index_song(self, song):
+        row_id = song["id"]
+        for genre, track in song.items():
+            if genre != "id" and track:
+                self._add((row_id, genre), track)
+
+    def update_song(self, song):
+        with self._lock:
+            self.remove_row(song["id"])
+            self._index_song(song)
+
+    def remove_row(self, row_id):
+        with self._lock:
+            for genre in list(self._rows.get(row_id, ())):
+                self._remove((row_id, genre))
+
+    def refresh(self, songs):
+        """Bring the index in line with a full read of the catalogue, one row at a time.
+
+        Only rows that differ from what is indexed are re-indexed, and rows that are gone
+        are dropped, so picking up writes made by other processes costs a comparison per
+        row rather than a rebuild. The lock is taken per row, so searches keep running.
+        """
+        seen = set()
+        for song in songs:
+            row_id = song["id"]
+            seen.add(row_id)
+            tracks = {genre: track for genre, track in song.items() if genre != "id" and track}
+            with self._lock:
+                indexed = self._rows.get(row_id, ())
+                if len(indexed) != len(tracks) or any(
+                    self._tracks.get((row_id, genre)) != track for genre, track in tracks.items()
+                ):
+                    self.update_song(song)
+        with self._lock:
+            for row_id in [row_id for row_id in self._rows if row_id not in seen]:
+                self.remove_row(row_id)
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self._tokens, prefix)
+        end = bisect.bisect_left(self._tokens, prefix + "\uffff")
+        return self._tokens[start:end]
+
+    @staticmethod
+    def _score(track, terms, prefixes):
+        """2 per term matching a whole token of the track, 1 per prefix match, 0 if any term misses."""
+        track_tokens = tokenize(track)
+        score = 0
+        for term in terms:
+            if term in track_tokens:
+                score += 2
+            elif prefixes and any(token.startswith(term) for token in track_tokens):
+                score += 1
+            else:
+                return 0
+        return score
+
+    def _candidates(self, driver, others):
+        """Yield, in rank order, keys found under `driver` and under every one of `others`.
+
+        Each argument is a list of tokens whose postings are pooled. The driver's postings
+        are read a window at a time. Every list is sorted the same way, so the keys of the
+        other terms that can meet a window are the ones up to its last key, and each window
+        is intersected with just those. The caller stops pulling once it has its results.
+        """
+        lists = [self._postings[token] for token in driver]
+        if len(lists) > 8:
+            # A short prefix can cover hundreds of small lists, and merging that many lazily
+            # costs more than sorting their keys once
+            stream = iter(sorted(itertools.chain.from_iterable(lists)))
+        else:
+            stream = heapq.merge(*lists)
+        cursors = [[0] * len(tokens) for tokens in others]
+        while True:
+            window = list(itertools.islice(stream, SEARCH_WINDOW))
+            if not window:
+                return
+            last = window[-1]
+            for tokens, positions in zip(others, cursors):
+                ranges = []
+                for i, token in enumerate(tokens):
+                    postings = self._postings[token]
+                    end = bisect.bisect_right(postings, last, positions[i])
+                    ranges.append((postings, positions[i], end))
+                    positions[i] = end
+                span = sum(end - start for _, start, end in ranges)
+                if span > 16 * len(window) * len(ranges):
+                    # A few keys against long lists: binary search beats hashing the lists
+                    window = [key for key in window if any(
+                        _contains(postings, key, start, end) for postings, start, end in ranges
+                    )]
+                else:
+                    reachable = set()
+                    for postings, start, end in ranges:
+                        reachable.update(itertools.islice(postings, start, end))
+                    window = [key for key in window if key in reachable]
+                if not window:
+                    break
+            yield from window
+
+    def search(self, query, genres=None, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            prefixes = any(len(term) >= SEARCH_MIN_PREFIX for term in terms)
+            sources = []
+            for term in terms:
+                if not prefixes:
+                    tokens = [term] if term in self._postings else []
+                elif len(term) >= SEARCH_MIN_PREFIX:
+                    tokens = self._prefix_matches(term)
+                else:
+                    continue
+                if not tokens:
+                    return []
+                sources.append(tokens)
+
+            # The term with the fewest postings drives, see _candidates()
+            sources.sort(key=lambda tokens: sum(len(self._postings[token]) for token in tokens))
+            candidates = self._candidates(sources[0], sources[1:])
+            best = sum(2 if term in self._postings else 1 for term in terms)
+
+            # score -> first `limit` rank keys with that score. Candidates arrive in rank
+            # order, so within a score the earliest ones are the ones to keep.
+            found = {}
+            previous = None
+            for key in candidates:
+                # A track with two tokens under the same prefix comes out of the merge twice
+                if key == previous:
+                    continue
+                previous = key
+                doc = self._doc(key)
+                if genres and doc[1] not in genres:
+                    continue
+                score = self._score(self._tracks[doc], terms, prefixes)
+                if not score:
+                    continue
+                bucket = found.setdefault(score, [])
+                if len(bucket) < limit:
+                    bucket.append(key)
+                    if score == best and len(bucket) == limit:
+                        break
+
+            ranked = [(score, self._doc(key)) for score in sorted(found, reverse=True) for key in found[score]]
+            return [
+                {"id": row_id, "genre": genre, "track": self._tracks[(row_id, genre)], "score": score}
+                for score, (row_id, genre) in ranked[:limit]
+            ]
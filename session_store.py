@@ -0,0 +1,178 @@
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import TTLCache
+
+SESSION_LIFETIME = int(os.getenv("SESSION_LIFETIME", 30 * 24 * 3600))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10000))
+# Kept short so a write made by another worker is picked up quickly
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 60))
+# How long a cached session is used without checking that its row still exists. At 0 a
+# logout or regenerate() in one worker ends the old id in every worker on its next request;
+# the check is a primary key lookup, still far cheaper than reading and decoding the data.
+SESSION_REVALIDATE_INTERVAL = float(os.getenv("SESSION_REVALIDATE_INTERVAL", 0))
+SESSION_PURGE_INTERVAL = int(os.getenv("SESSION_PURGE_INTERVAL", 3600))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id, e.g. at login, so an id planted earlier gets nothing."""
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class SessionStore:
+    """Session rows in the app database, with a per-process LRU in front of it.
+
+    Writes go through their own connection, so saving the session never commits
+    whatever the request left pending on db.session. Cached entries are revalidated
+    against the table (see SESSION_REVALIDATE_INTERVAL), so a session deleted by another
+    worker stops working everywhere.
+    """
+
+    def __init__(self, db, model):
+        self.db = db
+        self.table = model.__table__
+        self.cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+        self.serializer = TaggedJSONSerializer()
+        self._table_ready = False
+        self._last_purge = 0
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.table.create(self.db.engine, checkfirst=True)
+            self._table_ready = True
+
+    def _exists(self, sid):
+        self._ensure_table()
+        with self.db.engine.connect() as conn:
+            return conn.execute(
+                self.db.select(self.table.c.id).where(self.table.c.id == sid)
+            ).first() is not None
+
+    def load(self, sid):
+        entry = self.cache.get(sid)
+        if entry is not None and time.time() - entry["checked_at"] >= SESSION_REVALIDATE_INTERVAL:
+            if not self._exists(sid):
+                self.cache.delete(sid)
+                return None
+            entry["checked_at"] = time.time()
+        if entry is None:
+            self._ensure_table()
+            with self.db.engine.connect() as conn:
+                row = conn.execute(
+                    self.table.select().where(self.table.c.id == sid)
+                ).mappings().first()
+            if row is None:
+                return None
+            entry = {
+                "data": self.serializer.loads(row["data"]),
+                "expires_at": row["expires_at"],
+                "checked_at": time.time(),
+            }
+            self.cache.set(sid, entry)
+
+        if entry["expires_at"] < time.time():
+            self.delete(sid)
+            return None
+        return entry["data"]
+
+    def save(self, sid, data, expires_at):
+        self._ensure_table()
+        values = {"data": self.serializer.dumps(data), "expires_at": expires_at}
+        with self.db.engine.begin() as conn:
+            updated = conn.execute(
+                self.table.update().where(self.table.c.id == sid).values(**values)
+            ).rowcount
+            if not updated:
+                conn.execute(self.table.insert().values(id=sid, **values))
+        self.cache.set(sid, {"data": dict(data), "expires_at": expires_at, "checked_at": time.time()})
+
+        if time.time() - self._last_purge > SESSION_PURGE_INTERVAL:
+            self.purge_expired()
+
+    def delete(self, sid):
+        self.cache.delete(sid)
+        self._ensure_table()
+        with self.db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.id == sid))
+
+    def purge_expired(self):
+        """Delete every expired session in one statement (uses the expires_at index)."""
+        self._ensure_table()
+        self._last_purge = time.time()
+        with self.db.engine.begin() as conn:
+            return conn.execute(
+                self.table.delete().where(self.table.c.expires_at < time.time())
+            ).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps only a random session id in the cookie, the data lives in a SessionStore."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly
+                )
+            return
+
+        response.vary.add("Cookie")
+        expires_at = time.time() + SESSION_LIFETIME
+        if session.modified or session.new:
+            self.store.save(session.sid, dict(session), expires_at)
+
+        # The id only changes on regenerate(), so the cookie only has to be sent when it is new
+        if session.new:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=datetime.fromtimestamp(expires_at, timezone.utc),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
@@ -1,43 +1,59 @@
-from flask import Blueprint, redirect, request, session, jsonify
+from flask import Blueprint, Response, redirect, request, session, jsonify
 import requests
 import time
 import os
 import base64
-from dotenv import load_dotenv
-
-load_dotenv()
+import hashlib
+import itertools
+import json
+from cache import TTLCache
+from spotify_client import calling_route, spotify_http
+from metrics import metrics
+from token_manager import TokenManager
+from token_store import make_token_store
+from playback_stream import PlaybackBroadcaster, streaming_supported
 
 spotify = Blueprint("spotify", __name__)
 
 CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI")
-AUTH_URL = "https://accounts.spotify.com/authorize"
+# Overridable so the blueprint can be pointed at a local mock (see bench/mock_spotify.py)
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+AUTH_URL = f"{SPOTIFY_ACCOUNTS_URL}/authorize"
+
+# Timeouts and connection errors from spotify_http end up here instead of a bare 500
+@spotify.errorhandler(requests.exceptions.RequestException)
+def handle_spotify_request_error(e):
+    print(f"[ERROR] Spotify request failed: {e}")
+    return jsonify({"error": "Spotify request failed", "details": str(e)}), 502
+
 
-# Caching for client credentials flow
-access_token_cache = {"access_token": None, "expires_at": 0}
+# Client credentials token, shared across threads and optionally across workers
+client_token_store = make_token_store()
 
 def refresh_token():
-    auth_response = requests.post(
-        "https://accounts.spotify.com/api/token",
+    started = time.perf_counter()
+    auth_response = spotify_http.post(
+        f"{SPOTIFY_ACCOUNTS_URL}/api/token",
         data={"grant_type": "client_credentials"},
         auth=(CLIENT_ID, CLIENT_SECRET),
     )
+    metrics.observe("spotify_token_refresh_seconds", (("kind", "client_credentials"),), time.perf_counter() - started)
     if auth_response.status_code != 200:
         raise Exception("Failed to get token: " + auth_response.text)
 
     token_data = auth_response.json()
-    access_token_cache["access_token"] = token_data["access_token"]
-    access_token_cache["expires_at"] = time.time() + token_data["expires_in"] - 60
+    return {
+        "access_token": token_data["access_token"],
+        "expires_at": time.time() + token_data["expires_in"] - 60,
+    }
 
 @spotify.route("/token")
 def get_token():
-    if (
-        not access_token_cache["access_token"]
-        or time.time() > access_token_cache["expires_at"]
-    ):
-        refresh_token()
-    return jsonify({"access_token": access_token_cache["access_token"]})
+    token = client_token_store.get_or_refresh(refresh_token)
+    return jsonify({"access_token": token["access_token"]})
 
 @spotify.route("/login")
 def login():
@@ -64,7 +80,7 @@ def callback():
     if not code:
         return jsonify({"error": "Missing code param"}), 400
 
-    token_url = "https://accounts.spotify.com/api/token"
+    token_url = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
     payload = {
         "grant_type": "authorization_code",
         "code": code,
@@ -78,24 +94,24 @@ def callback():
     }
 
     try:
-        res = requests.post(token_url, data=payload, headers=headers)
+        res = spotify_http.post(token_url, data=payload, headers=headers)
         res.raise_for_status()
         tokens = res.json()
 
+        # Server-side sessions get a fresh id at login (session fixation); cookie sessions
+        # carry their data in the signed cookie itself and have no id to rotate
+        if hasattr(session, "regenerate"):
+            session.regenerate()
         session["access_token"] = tokens.get("access_token")
         session["refresh_token"] = tokens.get("refresh_token")
+        session["expires_at"] = time.time() + tokens.get("expires_in", 3600)
         return jsonify(tokens)
     except requests.exceptions.RequestException as e:
         print(f"Spotify token exchange failed: {e}")
         return jsonify({"error": "Token exchange failed", "details": str(e)}), 500
 
-@spotify.route("/refresh_access_token")
-def refresh_access_token():
-    refresh_token = session.get("refresh_token")
-    if not refresh_token:
-        return jsonify({"error": "No refresh token found"}), 400
-
-    token_url = "https://accounts.spotify.com/api/token"
+def request_token_refresh(refresh_token):
+    token_url = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
     payload = {
         "grant_type": "refresh_token",
         "refresh_token": refresh_token,
@@ -107,22 +123,45 @@ def refresh_access_token():
         "Content-Type": "application/x-www-form-urlencoded",
     }
 
+    res = spotify_http.post(token_url, data=payload, headers=headers)
+    res.raise_for_status()
+    return res.json()
+
+
+token_manager = TokenManager(request_token_refresh)
+
+
+def store_session_tokens(tokens):
+    # Only touch the session when something changed, so unchanged requests send no Set-Cookie
+    for key in ("access_token", "refresh_token", "expires_at"):
+        if session.get(key) != tokens[key]:
+            session[key] = tokens[key]
+
+
+@spotify.route("/refresh_access_token")
+def refresh_access_token():
+    refresh_token = session.get("refresh_token")
+    if not refresh_token:
+        return jsonify({"error": "No refresh token found"}), 400
+
     try:
-        res = requests.post(token_url, data=payload, headers=headers)
-        res.raise_for_status()
-        tokens = res.json()
-        session["access_token"] = tokens["access_token"]
+        tokens = token_manager.refresh(refresh_token)
+        store_session_tokens(tokens)
         return jsonify({"access_token": tokens["access_token"]})
     except requests.exceptions.RequestException as e:
         print(f"[ERROR] Failed to refresh token: {e}")
         return jsonify({"error": "Failed to refresh token", "details": str(e)}), 500
 
 def refresh_access_token_if_expired():
-    if not session.get("refresh_token"):
+    refresh_token = session.get("refresh_token")
+    if not refresh_token:
         return False
     try:
-        response = refresh_access_token()
-        return response.status_code == 200
+        tokens = token_manager.ensure_fresh(
+            refresh_token, session.get("access_token"), session.get("expires_at", 0)
+        )
+        store_session_tokens(tokens)
+        return True
     except Exception as e:
         print("[ERROR] Auto-refresh failed:", e)
         return False
@@ -137,8 +176,12 @@ def get_profile():
     headers = {"Authorization": f"Bearer {token}"}
 
     try:
-        profile_response = requests.get("https://api.spotify.com/v1/me", headers=headers)
-        playlists_response = requests.get("https://api.spotify.com/v1/me/playlists", headers=headers)
+        responses = spotify_http.fan_out({
+            "profile": ("GET", f"{SPOTIFY_API_URL}/me", {"headers": headers}),
+            "playlists": ("GET", f"{SPOTIFY_API_URL}/me/playlists", {"headers": headers}),
+        })
+        profile_response = responses["profile"]
+        playlists_response = responses["playlists"]
 
         if profile_response.status_code != 200:
             return jsonify({"error": "Failed to fetch profile", "details": profile_response.text}), 400
@@ -163,17 +206,29 @@ def get_profile():
         return jsonify({"error": "Failed to fetch user data", "details": str(e)}), 400
 
 
+PLAYLIST_ADD_CHUNK = 100  # Spotify's maximum number of URIs per add-items call
+MAX_BATCH_QUEUE = int(os.getenv("MAX_BATCH_QUEUE", 100))
+MAX_PLAYLIST_TRACKS = int(os.getenv("MAX_PLAYLIST_TRACKS", 1000))
+
+
 @spotify.route("/create_playlist", methods=["POST"])
 def create_playlist():
-    token = session.get("access_token")
-    if not token:
-
+    headers, error_response, status = get_spotify_headers()
+    if error_response:
         return jsonify({"error": "Unauthorized"}), 401
-
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    
-    # FIX: Add error handling
-    profile_response = requests.get("https://api.spotify.com/v1/me", headers=headers)
+    headers["Content-Type"] = "application/json"
+
+    data = request.json or {}
+    name = data.get("name")
+    uris = data.get("uris") or []
+    if not name:
+        return jsonify({"error": "Missing playlist name"}), 400
+    if not isinstance(uris, list):
+        return jsonify({"error": "uris must be a list"}), 400
+    if len(uris) > MAX_PLAYLIST_TRACKS:
+        return jsonify({"error": f"At most {MAX_PLAYLIST_TRACKS} tracks per playlist"}), 400
+
+    profile_response = spotify_http.get(f"{SPOTIFY_API_URL}/me", headers=headers)
     if profile_response.status_code != 200:
         return jsonify({"error": "Failed to fetch profile"}), 400
         
@@ -182,13 +237,79 @@ def create_playlist():
     
     if not user_id:
         return jsonify({"error": "Could not get user ID"}), 400
-    
-    
+
+    create_response = spotify_http.post(
+        f"{SPOTIFY_API_URL}/users/{user_id}/playlists",
+        headers=headers,
+        json={
+            "name": name,
+            "description": data.get("description", ""),
+            "public": bool(data.get("public", False)),
+        },
+    )
+    if create_response.status_code not in (200, 201):
+        return jsonify({"error": "Failed to create playlist", "details": create_response.text}), 400
+    playlist = create_response.json()
+    # /me/playlists must not keep serving the page cached before this playlist existed
+    invalidate_library_cache()
+
+    # Chunks go one after another so the tracks keep the order they were sent in
+    added = 0
+    for start in range(0, len(uris), PLAYLIST_ADD_CHUNK):
+        chunk = uris[start:start + PLAYLIST_ADD_CHUNK]
+        add_response = spotify_http.post(
+            f"{SPOTIFY_API_URL}/playlists/{playlist['id']}/tracks",
+            headers=headers,
+            json={"uris": chunk},
+        )
+        if add_response.status_code not in (200, 201):
+            return jsonify({
+                "error": "Failed to add tracks",
+                "details": add_response.text,
+                "playlist": playlist,
+                "tracks_added": added,
+            }), 400
+        added += len(chunk)
+
+    return jsonify({"playlist": playlist, "tracks_added": added}), 201
+
+
 @spotify.route("/logout")
 def logout():
     session.clear()
     return jsonify({"message": "Logged out successfully"}), 200
 
+# Frontends poll /player/state and /player/queue every second or two. Polls from the same
+# user inside PLAYER_CACHE_TTL share one upstream call; player commands bump the user's
+# generation so the next poll always goes upstream.
+PLAYER_CACHE_TTL = float(os.getenv("PLAYER_CACHE_TTL", 2))
+player_cache = TTLCache(maxsize=int(os.getenv("PLAYER_CACHE_SIZE", 4096)), ttl=PLAYER_CACHE_TTL)
+player_generations = TTLCache(maxsize=int(os.getenv("PLAYER_CACHE_SIZE", 4096)), ttl=3600)
+
+
+def invalidate_player_cache():
+    user_key = session_user_key()
+    player_generations.set(user_key, player_generations.get(user_key, 0) + 1)
+
+
+def cached_player_get(endpoint, error_message):
+    user_key = session_user_key()
+    key = (user_key, player_generations.get(user_key, 0), endpoint)
+
+    def load():
+        headers = {"Authorization": f"Bearer {session.get('access_token')}"}
+        res = spotify_http.get(f"{SPOTIFY_API_URL}{endpoint}", headers=headers)
+        return {"status": res.status_code, "body": res.content, "text": res.text}
+
+    entry = player_cache.get_or_set(key, load)
+    if entry["status"] != 200:
+        # Callers already waiting on this load share the error, but it is not kept
+        player_cache.delete(key)
+        return jsonify({"error": error_message, "details": entry["text"]}), 400
+
+    return Response(entry["body"], mimetype="application/json")
+
+
 @spotify.route("/player/devices")
 def get_player_devices():
     if not refresh_access_token_if_expired():
@@ -196,7 +317,7 @@ def get_player_devices():
 
     token = session.get("access_token")
     headers = {"Authorization": f"Bearer {token}"}
-    res = requests.get("https://api.spotify.com/v1/me/player/devices", headers=headers)
+    res = spotify_http.get(f"{SPOTIFY_API_URL}/me/player/devices", headers=headers)
 
     if res.status_code != 200:
         return jsonify({"error": "Failed to fetch devices", "details": res.text}), 400
@@ -231,15 +352,16 @@ def play_track():
     if position_ms is not None:
         payload["position_ms"] = position_ms
 
-    url = f"https://api.spotify.com/v1/me/player/play"
+    url = f"{SPOTIFY_API_URL}/me/player/play"
     if device_id:
         url += f"?device_id={device_id}"
 
-    res = requests.put(url, headers=headers, json=payload)
+    res = spotify_http.put(url, headers=headers, json=payload)
 
     if res.status_code != 204:
         return jsonify({"error": "Failed to play track", "details": res.text}), 400
 
+    invalidate_player_cache()
     return jsonify({"status": "playing"})
 
 @spotify.route("/player/state")
@@ -247,14 +369,50 @@ def get_current_playback():
     if not refresh_access_token_if_expired():
         return jsonify({"error": "Unauthorized"}), 401
 
-    token = session.get("access_token")
-    headers = {"Authorization": f"Bearer {token}"}
-    res = requests.get("https://api.spotify.com/v1/me/player", headers=headers)
+    return cached_player_get("/me/player", "Failed to fetch playback state")
 
+def fetch_playback_state(credentials):
+    tokens = token_manager.ensure_fresh(
+        credentials["refresh_token"], credentials["access_token"], credentials["expires_at"]
+    )
+    credentials.update(tokens)
+
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    res = spotify_http.get(f"{SPOTIFY_API_URL}/me/player", headers=headers)
+    if res.status_code == 204:
+        return None  # no active device
     if res.status_code != 200:
-        return jsonify({"error": "Failed to fetch playback state", "details": res.text}), 400
+        raise Exception(f"Failed to fetch playback state: {res.text}")
+    return res.json()
 
-    return jsonify(res.json())
+
+playback_broadcaster = PlaybackBroadcaster(fetch_playback_state)
+
+
+# Server-Sent Events: a snapshot first, then only the changed top-level fields.
+# Serve with GUNICORN_WORKER_CLASS=gevent, a sync worker holds one thread per open stream.
+@spotify.route("/player/stream")
+def stream_playback():
+    if not streaming_supported():
+        return jsonify({
+            "error": "Playback streaming unavailable",
+            "details": "Streams need the gevent worker (GUNICORN_WORKER_CLASS=gevent); poll /player/state instead",
+        }), 503
+    if not refresh_access_token_if_expired():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    credentials = {
+        "access_token": session.get("access_token"),
+        "refresh_token": session.get("refresh_token"),
+        "expires_at": session.get("expires_at", 0),
+    }
+    response = Response(
+        playback_broadcaster.stream(session_user_key(), credentials),
+        mimetype="text/event-stream",
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 @spotify.route("/player/transfer", methods=["PUT"])
 def transfer_playback():
@@ -271,8 +429,8 @@ def transfer_playback():
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     payload = {"device_ids": device_ids, "play": True}
 
-    res = requests.put(
-        "https://api.spotify.com/v1/me/player",
+    res = spotify_http.put(
+        f"{SPOTIFY_API_URL}/me/player",
         headers=headers,
         json=payload,
     )
@@ -280,6 +438,7 @@ def transfer_playback():
     if res.status_code != 204:
         return jsonify({"error": "Failed to transfer playback", "details": res.text}), 400
 
+    invalidate_player_cache()
     return jsonify({"status": "playback transferred"})
 
 @spotify.route("/player/repeat", methods=["PUT"])
@@ -296,14 +455,15 @@ def set_repeat():
         return jsonify({"error": "Invalid repeat mode"}), 400
 
     headers = {"Authorization": f"Bearer {token}"}
-    res = requests.put(
-        f"https://api.spotify.com/v1/me/player/repeat?state={state}&device_id={device_id}",
+    res = spotify_http.put(
+        f"{SPOTIFY_API_URL}/me/player/repeat?state={state}&device_id={device_id}",
         headers=headers,
     )
 
     if res.status_code != 204:
         return jsonify({"error": "Failed to set repeat", "details": res.text}), 400
 
+    invalidate_player_cache()
     return jsonify({"status": "repeat set", "repeat": state})
 
 @spotify.route("/player/shuffle", methods=["PUT"])
@@ -320,14 +480,15 @@ def set_shuffle():
         return jsonify({"error": "Missing 'state' (true/false)"}), 400
 
     headers = {"Authorization": f"Bearer {token}"}
-    res = requests.put(
-        f"https://api.spotify.com/v1/me/player/shuffle?state={str(state).lower()}&device_id={device_id}",
+    res = spotify_http.put(
+        f"{SPOTIFY_API_URL}/me/player/shuffle?state={str(state).lower()}&device_id={device_id}",
         headers=headers,
     )
 
     if res.status_code != 204:
         return jsonify({"error": "Failed to set shuffle", "details": res.text}), 400
 
+    invalidate_player_cache()
     return jsonify({"status": "shuffle set", "shuffle": state})
 
 @spotify.route("/player/queue")
@@ -335,14 +496,7 @@ def get_queue():
     if not refresh_access_token_if_expired():
         return jsonify({"error": "Unauthorized"}), 401
 
-    token = session.get("access_token")
-    headers = {"Authorization": f"Bearer {token}"}
-    res = requests.get("https://api.spotify.com/v1/me/player/queue", headers=headers)
-
-    if res.status_code != 200:
-        return jsonify({"error": "Failed to fetch queue", "details": res.text}), 400
-
-    return jsonify(res.json())  # contains 'currently_playing' and 'queue' list
+    return cached_player_get("/me/player/queue", "Failed to fetch queue")  # contains 'currently_playing' and 'queue' list
 
 @spotify.route("/player/queue", methods=["POST"])
 def add_to_queue():
@@ -358,17 +512,58 @@ def add_to_queue():
         return jsonify({"error": "Missing track URI"}), 400
 
     headers = {"Authorization": f"Bearer {token}"}
-    res = requests.post(
-        f"https://api.spotify.com/v1/me/player/queue?uri={uri}&device_id={device_id}",
+    res = spotify_http.post(
+        f"{SPOTIFY_API_URL}/me/player/queue?uri={uri}&device_id={device_id}",
         headers=headers
     )
 
     if res.status_code != 204:
         return jsonify({"error": "Failed to add to queue", "details": res.text}), 400
 
+    invalidate_player_cache()
     return jsonify({"status": "track queued", "uri": uri})
 
 
+@spotify.route("/player/queue/batch", methods=["POST"])
+def add_many_to_queue():
+    if not refresh_access_token_if_expired():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    token = session.get("access_token")
+    data = request.json or {}
+    uris = data.get("uris")
+    device_id = data.get("device_id", "")
+
+    if not uris or not isinstance(uris, list):
+        return jsonify({"error": "Missing or invalid uris"}), 400
+    if len(uris) > MAX_BATCH_QUEUE:
+        return jsonify({"error": f"At most {MAX_BATCH_QUEUE} tracks per batch"}), 400
+
+    # Spotify queues one track per call. The calls go back to back over the pooled
+    # keep-alive connection, in order, so the queue order matches the request.
+    headers = {"Authorization": f"Bearer {token}"}
+    queued = []
+    for uri in uris:
+        res = spotify_http.post(
+            f"{SPOTIFY_API_URL}/me/player/queue",
+            headers=headers,
+            params={"uri": uri, "device_id": device_id} if device_id else {"uri": uri},
+        )
+        if res.status_code not in (200, 204):
+            if queued:
+                invalidate_player_cache()
+            return jsonify({
+                "error": "Failed to add to queue",
+                "details": res.text,
+                "queued": queued,
+                "failed": uri,
+            }), 400
+        queued.append(uri)
+
+    invalidate_player_cache()
+    return jsonify({"status": "tracks queued", "queued": queued})
+
+
 # Helper
 def get_spotify_headers():
     refresh_access_token_if_expired()
@@ -378,22 +573,163 @@ def get_spotify_headers():
     return {"Authorization": f"Bearer {token}"}, None, None
 
 
+def session_user_key():
+    # The refresh token outlives access tokens, so it identifies the user across refreshes
+    secret = session.get("refresh_token") or session.get("access_token") or ""
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+# Per-user cache of library pages. Entries stay around for LIBRARY_CACHE_STALE_TTL so that,
+# once LIBRARY_CACHE_TTL has passed, they can be revalidated upstream with If-None-Match.
+LIBRARY_CACHE_TTL = int(os.getenv("LIBRARY_CACHE_TTL", 60))
+LIBRARY_CACHE_STALE_TTL = int(os.getenv("LIBRARY_CACHE_STALE_TTL", 3600))
+library_cache = TTLCache(
+    maxsize=int(os.getenv("LIBRARY_CACHE_SIZE", 2048)),
+    ttl=LIBRARY_CACHE_STALE_TTL,
+    max_bytes=int(os.getenv("LIBRARY_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    sizeof=lambda entry: len(entry["body"]),
+)
+# Bumped when the user changes their library through us, like player_generations
+library_generations = TTLCache(maxsize=int(os.getenv("LIBRARY_CACHE_SIZE", 2048)), ttl=LIBRARY_CACHE_STALE_TTL)
+
+
+def invalidate_library_cache():
+    user_key = session_user_key()
+    library_generations.set(user_key, library_generations.get(user_key, 0) + 1)
+
+
+def cached_library_get(url, headers, error_message):
+    """GET a library page through library_cache and answer conditional requests with 304."""
+    user_key = session_user_key()
+    key = (user_key, library_generations.get(user_key, 0), url)
+    entry = library_cache.get(key)
+
+    if entry is None or time.time() >= entry["fresh_until"]:
+        upstream_headers = dict(headers)
+        if entry and entry["upstream_etag"]:
+            upstream_headers["If-None-Match"] = entry["upstream_etag"]
+
+        res = spotify_http.get(url, headers=upstream_headers)
+
+        if res.status_code == 304 and entry:
+            entry = dict(entry, fresh_until=time.time() + LIBRARY_CACHE_TTL)
+        elif res.status_code != 200:
+            return jsonify({"error": error_message, "details": res.text}), 400
+        else:
+            entry = {
+                "body": res.content,
+                "etag": hashlib.sha1(res.content).hexdigest(),
+                "upstream_etag": res.headers.get("ETag"),
+                "fresh_until": time.time() + LIBRARY_CACHE_TTL,
+            }
+        library_cache.set(key, entry)
+
+    response = Response(entry["body"], mimetype="application/json")
+    response.set_etag(entry["etag"])
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
+# ?all=1 on the library routes walks every upstream page and streams one merged response
+SPOTIFY_AGGREGATE_CONCURRENCY = int(os.getenv("SPOTIFY_AGGREGATE_CONCURRENCY", 8))
+AGGREGATE_PAGE_SIZE = 50  # Spotify's maximum for the library endpoints
+
+
+def wants_all_pages():
+    return request.args.get("all") in ("1", "true")
+
+
+def stream_aggregate(first_page, more_pages, total):
+    """Stream {"items": [...], "total", "length"} as pages arrive.
+
+    The status line is already sent when a later page fails, so the failure is
+    reported in an "error" field at the end of the body.
+    """
+    yield '{"items":['
+    count = 0
+    error = None
+    try:
+        for page in itertools.chain([first_page], more_pages):
+            for item in page.get("items", []):
+                yield ("," if count else "") + json.dumps(item)
+                count += 1
+    except Exception as e:
+        print(f"[ERROR] Library aggregation stopped early: {e}")
+        error = str(e)
+
+    tail = {"total": total, "length": count}
+    if error:
+        tail["error"] = error
+    yield "]," + json.dumps(tail)[1:]
+
+
+def aggregate_offset_pages(endpoint, headers, error_message):
+    """Fetch page one, read its total, then fetch the remaining offsets in parallel."""
+    first_url = f"{SPOTIFY_API_URL}{endpoint}?limit={AGGREGATE_PAGE_SIZE}&offset=0"
+    res = spotify_http.get(first_url, headers=headers)
+    if res.status_code != 200:
+        return jsonify({"error": error_message, "details": res.text}), 400
+
+    first_page = res.json()
+    total = first_page.get("total", 0)
+    urls = [
+        f"{SPOTIFY_API_URL}{endpoint}?limit={AGGREGATE_PAGE_SIZE}&offset={offset}"
+        for offset in range(AGGREGATE_PAGE_SIZE, total, AGGREGATE_PAGE_SIZE)
+    ]
+
+    # The pages are fetched while the response streams, after the request context is gone
+    route = calling_route()
+
+    def more_pages():
+        pages = spotify_http.get_many(urls, SPOTIFY_AGGREGATE_CONCURRENCY, route=route, headers=headers)
+        for page_res in pages:
+            if page_res.status_code != 200:
+                raise Exception(f"{error_message}: {page_res.text}")
+            yield page_res.json()
+
+    return Response(stream_aggregate(first_page, more_pages(), total), mimetype="application/json")
+
+
+def aggregate_followed_artists(headers):
+    """/me/following pages by an `after` cursor, so pages are followed one by one."""
+    url = f"{SPOTIFY_API_URL}/me/following?type=artist&limit={AGGREGATE_PAGE_SIZE}"
+    res = spotify_http.get(url, headers=headers)
+    if res.status_code != 200:
+        return jsonify({"error": "Failed to fetch followed artists", "details": res.text}), 400
+
+    first_page = res.json()["artists"]
+    route = calling_route()
+
+    def more_pages():
+        next_url = first_page.get("next")
+        while next_url:
+            page_res = spotify_http.request_for_route(route, "GET", next_url, headers=headers)
+            if page_res.status_code != 200:
+                raise Exception(f"Failed to fetch followed artists: {page_res.text}")
+            page = page_res.json()["artists"]
+            yield page
+            next_url = page.get("next")
+
+    return Response(
+        stream_aggregate(first_page, more_pages(), first_page.get("total", 0)),
+        mimetype="application/json",
+    )
+
+
 @spotify.route("/me/albums")
 def get_saved_albums():
     headers, error_response, status = get_spotify_headers()
     if error_response:
         return error_response, status
 
+    if wants_all_pages():
+        return aggregate_offset_pages("/me/albums", headers, "Failed to fetch albums")
+
     limit = request.args.get("limit", 20)
     offset = request.args.get("offset", 0)
 
-    url = f"https://api.spotify.com/v1/me/albums?limit={limit}&offset={offset}"
-    res = requests.get(url, headers=headers)
-
-    if res.status_code != 200:
-        return jsonify({"error": "Failed to fetch albums", "details": res.text}), 400
-
-    return jsonify(res.json())
+    url = f"{SPOTIFY_API_URL}/me/albums?limit={limit}&offset={offset}"
+    return cached_library_get(url, headers, "Failed to fetch albums")
 
 
 @spotify.route("/me/artists")
@@ -402,19 +738,17 @@ def get_followed_artists():
     if error_response:
         return error_response, status
 
+    if wants_all_pages():
+        return aggregate_followed_artists(headers)
+
     limit = request.args.get("limit", 20)
     after = request.args.get("after", "")
 
-    url = f"https://api.spotify.com/v1/me/following?type=artist&limit={limit}"
+    url = f"{SPOTIFY_API_URL}/me/following?type=artist&limit={limit}"
     if after:
         url += f"&after={after}"
 
-    res = requests.get(url, headers=headers)
-
-    if res.status_code != 200:
-        return jsonify({"error": "Failed to fetch followed artists", "details": res.text}), 400
-
-    return jsonify(res.json())
+    return cached_library_get(url, headers, "Failed to fetch followed artists")
 
 
 @spotify.route("/me/shows")
@@ -423,16 +757,14 @@ def get_saved_shows():
     if error_response:
         return error_response, status
 
+    if wants_all_pages():
+        return aggregate_offset_pages("/me/shows", headers, "Failed to fetch saved shows")
+
     limit = request.args.get("limit", 20)
     offset = request.args.get("offset", 0)
 
-    url = f"https://api.spotify.com/v1/me/shows?limit={limit}&offset={offset}"
-    res = requests.get(url, headers=headers)
-
-    if res.status_code != 200:
-        return jsonify({"error": "Failed to fetch saved shows", "details": res.text}), 400
-
-    return jsonify(res.json())
+    url = f"{SPOTIFY_API_URL}/me/shows?limit={limit}&offset={offset}"
+    return cached_library_get(url, headers, "Failed to fetch saved shows")
 
 
 @spotify.route("/me/playlists")
@@ -441,14 +773,12 @@ def get_user_playlists():
     if error_response:
         return error_response, status
 
+    if wants_all_pages():
+        return aggregate_offset_pages("/me/playlists", headers, "Failed to fetch playlists")
+
     limit = request.args.get("limit", 20)
     offset = request.args.get("offset", 0)
 
-    url = f"https://api.spotify.com/v1/me/playlists?limit={limit}&offset={offset}"
-    res = requests.get(url, headers=headers)
-
-    if res.status_code != 200:
-        return jsonify({"error": "Failed to fetch playlists", "details": res.text}), 400
-
-    return jsonify(res.json())
+    url = f"{SPOTIFY_API_URL}/me/playlists?limit={limit}&offset={offset}"
+    return cached_library_get(url, headers, "Failed to fetch playlists")
 
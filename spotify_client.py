@@ -0,0 +1,241 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from flask import has_request_context
+from requests.adapters import HTTPAdapter
+
+from metrics import current_route, metrics
+
+SPOTIFY_POOL_CONNECTIONS = int(os.getenv("SPOTIFY_POOL_CONNECTIONS", 4))
+SPOTIFY_POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", 20))
+SPOTIFY_CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", 3.05))
+SPOTIFY_READ_TIMEOUT = float(os.getenv("SPOTIFY_READ_TIMEOUT", 10))
+SPOTIFY_FANOUT_WORKERS = int(os.getenv("SPOTIFY_FANOUT_WORKERS", 16))
+
+# Outbound rate limits, in requests per second with a burst allowance
+SPOTIFY_APP_RATE = float(os.getenv("SPOTIFY_APP_RATE", 50))
+SPOTIFY_APP_BURST = int(os.getenv("SPOTIFY_APP_BURST", 100))
+SPOTIFY_USER_RATE = float(os.getenv("SPOTIFY_USER_RATE", 10))
+SPOTIFY_USER_BURST = int(os.getenv("SPOTIFY_USER_BURST", 20))
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", 3))
+SPOTIFY_MAX_RETRY_WAIT = float(os.getenv("SPOTIFY_MAX_RETRY_WAIT", 10))
+
+RETRYABLE_GET_STATUSES = (500, 502, 503, 504)
+
+# Route label for calls made on pool threads, which have no request context of their own
+_route_local = threading.local()
+
+
+def calling_route():
+    if has_request_context():
+        return current_route()
+    return getattr(_route_local, "route", "background")
+
+
+class TokenBucket:
+    """Thread-safe token bucket. acquire() sleeps until a token is free, for at most max_wait."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=SPOTIFY_MAX_RETRY_WAIT):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take the token now even if it goes negative, so waiters queue up in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            if wait > max_wait:
+                # The queue is longer than max_wait. Hand the token back rather than run up
+                # debt that every later caller would have to sleep off
+                self._tokens += 1
+                wait = max_wait
+        if wait:
+            time.sleep(min(wait, max_wait))
+
+
+class SpotifyHTTPClient:
+    """One pooled keep-alive session shared by every handler in the blueprint.
+
+    urllib3 connection pools are thread-safe. The session keeps no cookies, so
+    it has no per-request state and can be shared across threads.
+    """
+
+    def __init__(self, pool_connections=SPOTIFY_POOL_CONNECTIONS, pool_maxsize=SPOTIFY_POOL_SIZE,
+                 timeout=(SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT)):
+        self.timeout = timeout
+        self.app_bucket = TokenBucket(SPOTIFY_APP_RATE, SPOTIFY_APP_BURST)
+        self._user_buckets = {}
+        self._blocked_until = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        # pool_connections is the number of hosts kept alive, pool_maxsize the sockets per host
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=SPOTIFY_FANOUT_WORKERS, thread_name_prefix="spotify-fanout")
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the rate limiter, retrying 429s and (for GETs) 5xx.
+
+        Identical GETs already in flight, same url, params and headers, share one
+        upstream call. A conditional GET (If-None-Match) never hands its 304 to a plain one.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if method != "GET" or "data" in kwargs or "json" in kwargs:
+            return self._send(method, url, kwargs)
+
+        headers = kwargs.get("headers") or {}
+        key = (url, repr(sorted(headers.items())), repr(sorted((kwargs.get("params") or {}).items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            response = self._send(method, url, kwargs)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def request_for_route(self, route, method, url, **kwargs):
+        """request() labelled with `route`, for calls made after the view has returned."""
+        previous = getattr(_route_local, "route", None)
+        _route_local.route = route
+        try:
+            return self.request(method, url, **kwargs)
+        finally:
+            _route_local.route = previous
+
+    def _user_bucket(self, authorization):
+        with self._lock:
+            bucket = self._user_buckets.get(authorization)
+            if bucket is None:
+                # Access tokens rotate hourly, so drop idle buckets instead of keeping every token
+                if len(self._user_buckets) > 10000:
+                    self._user_buckets.clear()
+                bucket = self._user_buckets[authorization] = TokenBucket(SPOTIFY_USER_RATE, SPOTIFY_USER_BURST)
+            return bucket
+
+    def _send(self, method, url, kwargs):
+        authorization = (kwargs.get("headers") or {}).get("Authorization", "")
+        user_bucket = self._user_bucket(authorization) if authorization.startswith("Bearer ") else None
+
+        for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+            # A 429 applies to the whole app, so everyone waits out Retry-After
+            blocked_for = self._blocked_until - time.monotonic()
+            if blocked_for > 0:
+                # Jitter so the waiting requests do not all hit Spotify in the same instant
+                time.sleep(min(blocked_for, SPOTIFY_MAX_RETRY_WAIT) + random.uniform(0, 0.25))
+            self.app_bucket.acquire()
+            if user_bucket:
+                user_bucket.acquire()
+
+            response = self._timed_request(method, url, kwargs)
+            if attempt == SPOTIFY_MAX_RETRIES:
+                return response
+
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.headers.get("Retry-After", 1))
+                except ValueError:
+                    retry_after = 1
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                print(f"[WARN] Spotify rate limited {method} {url}, retrying in {retry_after}s")
+                continue
+            if method == "GET" and response.status_code in RETRYABLE_GET_STATUSES:
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, min(SPOTIFY_MAX_RETRY_WAIT, 0.25 * 2 ** attempt)))
+                continue
+            return response
+
+    def _timed_request(self, method, url, kwargs):
+        labels = (("route", calling_route()), ("method", method), ("host", urlparse(url).netloc))
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.observe("spotify_upstream_duration_seconds", labels, time.perf_counter() - start)
+            metrics.inc("spotify_upstream_requests_total", labels + (("status", status),))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def fan_out(self, calls):
+        """Run independent requests at the same time and return their responses by name.
+
+        `calls` maps a name to (method, url) or (method, url, kwargs). The slowest call
+        sets the latency instead of the sum of all of them. The first exception raised
+        by any call is re-raised once all calls have finished.
+        """
+        route = calling_route()
+        futures = {}
+        for name, call in calls.items():
+            method, url, kwargs = call if len(call) == 3 else (*call, {})
+            futures[name] = self.executor.submit(self.request_for_route, route, method, url, **kwargs)
+
+        results = {}
+        error = None
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                error = error or e
+        if error:
+            raise error
+        return results
+
+    def get_many(self, urls, concurrency=8, route=None, **kwargs):
+        """GET every url with at most `concurrency` in flight, yielding responses in order.
+
+        This is a generator, so nothing runs until it is iterated. Callers that iterate it
+        from a streamed response must pass `route`, since the request context is gone by then.
+        """
+        route = route or calling_route()
+        pending = deque()
+        for url in urls:
+            pending.append(self.executor.submit(self.request_for_route, route, "GET", url, **kwargs))
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+spotify_http = SpotifyHTTPClient()
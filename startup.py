@@ -0,0 +1,43 @@
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Cold-start timings: how long importing app.py and each create_app() step took.
+
+    Logged once when the app is ready and served at /debug/startup, so import or boot
+    regressions show up next to the request benchmarks.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.ready_ms = None
+        self.first_request_ms = None
+
+    def record(self, name, since):
+        self.phases[name] = round((time.perf_counter() - since) * 1000, 2)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def ready(self):
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 2)
+        phases = ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.phases.items())
+        print(f"[STARTUP] ready in {self.ready_ms:.1f} ms ({phases})")
+
+    def first_request(self):
+        if self.first_request_ms is None:
+            self.first_request_ms = round((time.perf_counter() - self.started) * 1000, 2)
+
+    def snapshot(self):
+        return {
+            "phases_ms": dict(self.phases),
+            "ready_ms": self.ready_ms,
+            "first_request_ms": self.first_request_ms,
+        }
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cache import TTLCache
+from metrics import metrics
+
+# Refresh this many seconds before Spotify says the token expires
+TOKEN_EXPIRY_SKEW = int(os.getenv("SPOTIFY_TOKEN_EXPIRY_SKEW", 60))
+# Inside this window a refresh is started in the background and the current token is still used
+TOKEN_REFRESH_AHEAD = int(os.getenv("SPOTIFY_TOKEN_REFRESH_AHEAD", 300))
+
+
+class TokenManager:
+    """Keeps per-user access tokens fresh without a refresh call on every request.
+
+    Users are keyed by their refresh token. `refresh_fn(refresh_token)` must return
+    Spotify's token JSON (access_token, expires_in and optionally a rotated refresh_token)
+    or raise. Concurrent refreshes for the same user share one upstream call.
+    """
+
+    def __init__(self, refresh_fn, skew=TOKEN_EXPIRY_SKEW, refresh_ahead=TOKEN_REFRESH_AHEAD):
+        self.refresh_fn = refresh_fn
+        self.skew = skew
+        self.refresh_ahead = refresh_ahead
+        # Latest tokens per refresh token, so requests still carrying an old cookie pick them up
+        self._tokens = TTLCache(maxsize=10000, ttl=3600)
+        self._inflight = {}
+        self._scheduled = set()  # refresh tokens with a background refresh queued or running
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="token-refresh")
+
+    def ensure_fresh(self, refresh_token, access_token, expires_at):
+        """Return {"access_token", "refresh_token", "expires_at"}, refreshing only when needed."""
+        tokens = {"access_token": access_token, "refresh_token": refresh_token, "expires_at": expires_at or 0}
+
+        known = self._tokens.get(refresh_token)
+        if known and known["expires_at"] > tokens["expires_at"]:
+            tokens = known
+
+        now = time.time()
+        if not tokens["access_token"] or now >= tokens["expires_at"] - self.skew:
+            return self.refresh(refresh_token)
+        if now >= tokens["expires_at"] - self.refresh_ahead:
+            with self._lock:
+                schedule = refresh_token not in self._scheduled and refresh_token not in self._inflight
+                if schedule:
+                    self._scheduled.add(refresh_token)
+            if schedule:
+                self._executor.submit(self._refresh_quietly, refresh_token)
+        return tokens
+
+    def refresh(self, refresh_token):
+        """Refresh now, joining a refresh for the same user that is already running."""
+        with self._lock:
+            future = self._inflight.get(refresh_token)
+            owner = future is None
+            if owner:
+                future = self._inflight[refresh_token] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            started = time.perf_counter()
+            data = self.refresh_fn(refresh_token)
+            metrics.observe("spotify_token_refresh_seconds", (("kind", "user"),), time.perf_counter() - started)
+            tokens = {
+                "access_token": data["access_token"],
+                "refresh_token": data.get("refresh_token") or refresh_token,
+                "expires_at": time.time() + data.get("expires_in", 3600),
+            }
+            self._tokens.set(refresh_token, tokens)
+            if tokens["refresh_token"] != refresh_token:
+                self._tokens.set(tokens["refresh_token"], tokens)
+            future.set_result(tokens)
+            return tokens
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(refresh_token, None)
+
+    def _refresh_quietly(self, refresh_token):
+        try:
+            # Another request may have refreshed this user while the task sat in the queue
+            known = self._tokens.get(refresh_token)
+            if known and time.time() < known["expires_at"] - self.refresh_ahead:
+                return
+            self.refresh(refresh_token)
+        except Exception as e:
+            print(f"[ERROR] Background token refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._scheduled.discard(refresh_token)
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, only the in-memory store is available
+    fcntl = None
+
+
+class TokenStore(ABC):
+    """Holds one {"access_token", "expires_at"} token shared by everything using the store.
+
+    `get_or_refresh` is the stampede guard: callers that find the token expired queue on
+    `locked()`, and only the first one calls upstream. The others re-read the new token.
+    """
+
+    @abstractmethod
+    def read(self):
+        """Return the stored token, {"access_token": None, "expires_at": 0} when there is none."""
+
+    @abstractmethod
+    def write(self, token):
+        """Store the token for every later reader."""
+
+    @abstractmethod
+    def locked(self):
+        """Context manager that holds the store's refresh lock."""
+
+    def get_or_refresh(self, refresh_fn):
+        token = self.read()
+        if token["access_token"] and time.time() < token["expires_at"]:
+            return token
+
+        with self.locked():
+            token = self.read()
+            if token["access_token"] and time.time() < token["expires_at"]:
+                return token
+            token = refresh_fn()
+            self.write(token)
+            return token
+
+
+class MemoryTokenStore(TokenStore):
+    """Per-process store, every gunicorn worker refreshes once per expiry window."""
+
+    def __init__(self):
+        self._token = {"access_token": None, "expires_at": 0}
+        self._lock = threading.Lock()
+
+    def read(self):
+        return dict(self._token)
+
+    def write(self, token):
+        self._token = dict(token)
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            yield
+
+
+class FileTokenStore(TokenStore):
+    """Store shared by every worker on the host through a JSON file and an flock'd lock file."""
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError("FileTokenStore needs fcntl, which is not available on this platform")
+        self.path = path
+        self.lock_path = path + ".lock"
+        # flock is per open file, so threads of one worker also need a regular lock
+        self._thread_lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                token = json.load(f)
+            return {"access_token": token["access_token"], "expires_at": token["expires_at"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {"access_token": None, "expires_at": 0}
+
+    def write(self, token):
+        # Write then rename, so readers never see a half-written file
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"access_token": token["access_token"], "expires_at": token["expires_at"]}, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def locked(self):
+        with self._thread_lock:
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def make_token_store():
+    """Build the store named by SPOTIFY_TOKEN_STORE ("memory" or "file")."""
+    backend = os.getenv("SPOTIFY_TOKEN_STORE", "memory").lower()
+    if backend == "file":
+        path = os.getenv(
+            "SPOTIFY_TOKEN_STORE_PATH",
+            os.path.join(tempfile.gettempdir(), "spotify_client_token.json"),
+        )
+        try:
+            return FileTokenStore(path)
+        except RuntimeError as e:
+            print(f"[WARN] {e}, falling back to the in-memory token store")
+    return MemoryTokenStore()